@@ -1,9 +1,14 @@
+import os
 import sys
+import uuid
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
 from fastapi.responses import StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pydantic import ValidationError
 
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 
@@ -17,15 +22,22 @@ sys.path.insert(3, "configuration")
 from schemas import QueryInput, SettingsInput, SummarizeRequest
 
 # Importing functions to fetch and update settings
-from settings_manager import fetch_settings, insert_settings
+from application.settings_manager import afetch_settings, insert_settings, listen_for_settings_changes
 
 # Importing the main function to execute the agent
-from source.ast_main import execute_agent, execute_agent_0
-from source.summarization import summarize
+from source.ast_main import execute_agent_events, execute_agent_async
+from source.summarization import astream_summary
+from source.search_tools import close_http_session
 
 # Importing the websocket module
 from ws_server import manager
 
+# Importing the fair-share scheduler for agent runs
+from application.scheduler import FairScheduler, SchedulerFull
+from semantic_cache import semantic_cache_stats
+from single_flight import single_flight_stats
+from metrics import current_app_id, observe, record_queue_wait, record_rejection, render_metrics
+
 # Creating a FastAPI instance
 app = FastAPI()
 
@@ -38,6 +50,47 @@ app.add_middleware(
     allow_headers=["*"],  # Adjust this to allow only specific headers
 )
 
+# Caps and fair queuing of agent runs on this worker and per application
+scheduler = FairScheduler(
+    max_concurrent=int(os.environ.get("MAX_CONCURRENT_RUNS", 32)),
+    default_per_app=int(os.environ.get("MAX_CONCURRENT_RUNS_PER_APP", 8)),
+    default_queue_depth=int(os.environ.get("MAX_QUEUED_RUNS_PER_APP", 64)),
+    max_queued=int(os.environ.get("MAX_QUEUED_RUNS", 1024)),
+    on_wait=record_queue_wait,
+    on_reject=record_rejection,
+)
+
+@app.on_event("startup")
+async def configure_executor():
+    """
+    Bounds the thread pool used for sync-only tools and history I/O of async agent runs.
+    """
+    pool_size = int(os.environ.get("AGENT_THREAD_POOL_SIZE", 32))
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="agent-sync")
+    )
+
+@app.on_event("startup")
+async def start_settings_listener():
+    """
+    Starts listening for settings updates published by any worker.
+    """
+    app.state.settings_listener = asyncio.create_task(listen_for_settings_changes())
+
+@app.on_event("shutdown")
+async def stop_settings_listener():
+    """
+    Stops the settings update listener.
+    """
+    app.state.settings_listener.cancel()
+
+@app.on_event("shutdown")
+async def close_search_connections():
+    """
+    Closes the pooled HTTP connections used by the web search tool.
+    """
+    await close_http_session()
+
 @app.get("/")
 async def root():
     """
@@ -48,6 +101,32 @@ async def root():
     """
     return {"message": "Service is healthy and running."}
 
+@app.get("/stats")
+async def stats() -> dict:
+    """
+    Returns the scheduler, semantic cache and request coalescing counters of this worker.
+
+    Returns:
+        dict: Per application queue depth, runs in flight, rejections and queue-wait
+            times, the semantic cache hit rates and the single-flight counters.
+    """
+    return {
+        "scheduler": scheduler.stats(),
+        "semantic_cache": semantic_cache_stats(),
+        "single_flight": single_flight_stats(),
+    }
+
+@app.get("/metrics")
+async def metrics() -> Response:
+    """
+    Exposes the per-stage latency histograms in the Prometheus text format.
+
+    Returns:
+        Response: The metrics of this worker, or of all workers when PROMETHEUS_MULTIPROC_DIR is set.
+    """
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
 @app.post("/invoke/{app_id}")
 async def invoke_agent(app_id: str, query_input:QueryInput) -> dict:
     """
@@ -62,11 +141,20 @@ async def invoke_agent(app_id: str, query_input:QueryInput) -> dict:
         """
     in_params= {"app_name": app_id, "session_id": query_input.session_id, "query": query_input.query}
     try:
-        settings = fetch_settings(app_id)
-        if settings is None:
+        # Metrics are labelled "unknown" until the app_id is known to have settings
+        with observe("settings_fetch"):
+            settings = await afetch_settings(app_id)
+        if not settings:
             raise HTTPException(status_code=404, detail="Settings not found")
-        result = execute_agent_0(in_params, settings)
+        current_app_id.set(app_id)
+        async with scheduler.slot(app_id, settings):
+            with observe("agent_run"):
+                result = await execute_agent_async(in_params, settings)
         return {"result": result}
+    except SchedulerFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -76,33 +164,90 @@ async def websocket_endpoint(websocket: WebSocket, app_id: str):
     """
     WebSocket endpoint to invoke the agent driver function using the app_id and input parameters.
 
+    Every query runs as its own task, so a connection can have several requests
+    in flight and keeps reading while they run. A {"type": "cancel"} message
+    aborts the request with the given request_id, or all requests of the connection.
+
     Args:
         websocket (WebSocket): The WebSocket connection.
         app_id (str): The name of the application.
     """
-    await manager.connect(websocket)
+    await manager.connect(websocket, app_id)
     try:
         while True:
             data = await websocket.receive_json()
-            query_input = QueryInput(**data)
-            in_params = {
-                "app_name": app_id, 
-                "session_id": query_input.session_id, 
-                "query": query_input.query
-                }
+            if data.get("type") == "cancel":
+                cancelled = manager.cancel_request(websocket, data.get("request_id"))
+                if not cancelled:
+                    await manager.send_json(
+                        {"type": "error", "request_id": data.get("request_id"), "content": "No such request"},
+                        websocket,
+                    )
+                continue
+
             try:
-                settings = fetch_settings(app_id)
-                if settings is None:
-                    await manager.send_personal_message("Settings not found", websocket)
-                    continue
-                
-                # Use async for to handle streaming response
-                async for result in execute_agent(in_params, settings):
-                    await manager.send_personal_message(result, websocket)
-            except Exception as e:
-                await manager.send_personal_message(f"Error: {str(e)}", websocket)
+                query_input = QueryInput(**data)
+            except ValidationError as e:
+                await manager.send_json({"type": "error", "content": f"Error: {str(e)}"}, websocket)
+                continue
+
+            request_id = query_input.request_id or uuid.uuid4().hex
+            manager.bind_session(websocket, query_input.session_id)
+            started = manager.start_request(websocket, request_id, handle_ws_request(websocket, app_id, request_id, {
+                "app_name": app_id,
+                "session_id": query_input.session_id,
+                "query": query_input.query
+            }))
+            if not started:
+                await manager.send_json(
+                    {"type": "error", "request_id": request_id, "content": "Too many requests in flight"},
+                    websocket,
+                )
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket)
+
+
+async def handle_ws_request(websocket: WebSocket, app_id: str, request_id: str, in_params: dict):
+    """
+    Runs one WebSocket request and streams its frames, tagged with the request id.
+
+    Args:
+        websocket (WebSocket): The WebSocket connection.
+        app_id (str): The name of the application.
+        request_id (str): Identifier of the request.
+        in_params (dict): Input parameters for the agent execution.
+    """
+    async def tagged(frames):
+        async for frame in frames:
+            yield {**frame, "request_id": request_id}
+
+    try:
+        # Metrics are labelled "unknown" until the app_id is known to have settings
+        with observe("settings_fetch"):
+            settings = await afetch_settings(app_id)
+        if not settings:
+            await manager.send_json({"type": "error", "request_id": request_id, "content": "Settings not found"}, websocket)
+            return
+        current_app_id.set(app_id)
+
+        # Stream tokens, tool calls and the final answer as typed frames
+        async with scheduler.slot(app_id, settings):
+            with observe("agent_run"):
+                await manager.stream(tagged(execute_agent_events(in_params, settings)), websocket)
+    except asyncio.CancelledError:
+        # Cancelled by the client or by its disconnect, only the former can be told
+        if websocket in manager.active_connections:
+            await asyncio.shield(manager.send_json({"type": "cancelled", "request_id": request_id}, websocket))
+        raise
+    except SchedulerFull as e:
+        await manager.send_json(
+            {"type": "error", "request_id": request_id, "content": str(e), "retry_after": e.retry_after},
+            websocket,
+        )
+    except Exception as e:
+        await manager.send_json({"type": "error", "request_id": request_id, "content": f"Error: {str(e)}"}, websocket)
 #########################
 
 
@@ -117,7 +262,7 @@ async def update_settings(app_id: str, settings_input: SettingsInput) -> dict:
 @app.get("/settings/{app_id}")
 async def get_settings(app_id: str) -> dict:
     try:
-        settings= fetch_settings(app_id)
+        settings= await afetch_settings(app_id)
         return settings
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -126,10 +271,33 @@ async def get_settings(app_id: str) -> dict:
 # Define the API endpoint
 @app.post("/summarize/")
 async def summarize_endpoint(request: SummarizeRequest):
-    try:
-        summary = summarize(request.session_id)
-        return StreamingResponse(summarize(request.session_id), media_type="text/event-stream")
+    """
+    Streams the summary of a session as server-sent events while it is generated.
+
+    Args:
+        request (SummarizeRequest): The session to summarize.
+
+    Returns:
+        StreamingResponse: An event stream of summary tokens.
+    """
+    return StreamingResponse(summary_events(request.session_id), media_type="text/event-stream")
 
-        # return {"summary": summary}
+
+async def summary_events(session_id: str):
+    """
+    Formats the summary tokens of a session as server-sent events.
+
+    Args:
+        session_id (str): The session to summarize.
+
+    Yields:
+        str: One server-sent event per token, then a final "done" event.
+    """
+    try:
+        async for token in astream_summary(session_id):
+            data = "\n".join(f"data: {line}" for line in token.split("\n"))
+            yield f"{data}\n\n"
+        yield "event: done\ndata: \n\n"
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        # The response has already started, so the error is reported in the stream
+        yield f"event: error\ndata: {str(e)}\n\n"
@@ -0,0 +1,231 @@
+import asyncio
+import math
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+
+class SchedulerFull(Exception):
+    """
+    Raised when a run cannot be queued because the queue of its application is full.
+
+    Attributes:
+        app_id (str): The name of the application.
+        retry_after (int): Seconds after which the client should retry.
+    """
+    def __init__(self, app_id: str, retry_after: int):
+        super().__init__(f"Too many queued runs for {app_id}, retry after {retry_after}s")
+        self.app_id = app_id
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """
+    Admits agent runs with per-application weighted fair queuing.
+
+    At most max_concurrent runs are in flight on the worker, and each application
+    is capped at its own max_concurrency. Runs that cannot start wait in a bounded
+    queue per application; when a slot frees up, the waiting run with the smallest
+    virtual finish tag goes next, so an application gets slots in proportion to its
+    weight whatever its burst size. Runs started at once are charged the same way,
+    so an application that had the worker to itself queues behind the others
+    when they arrive. A run arriving at a full queue is rejected at once with
+    SchedulerFull.
+
+    The queue and virtual time of an application are dropped once it has no run
+    in flight or waiting; its counters are kept. Only applications with settings
+    reach the scheduler, so the counters are bounded by the configured applications.
+
+    Per application options are read from settings["parent_settings"]["scheduling"]:
+    "weight", "max_concurrency" and "max_queue". A "max_concurrency" directly under
+    "parent_settings" is still honoured.
+
+    Attributes:
+        max_concurrent (int): Maximum number of agent runs in flight on this worker.
+        default_per_app (int): Default maximum number of runs in flight per application.
+        default_queue_depth (int): Default maximum number of waiting runs per application.
+        max_queued (int): Maximum number of waiting runs on this worker.
+        on_wait (callable): Called with the application and the seconds a run waited.
+        on_reject (callable): Called with the application of a rejected run.
+    """
+    def __init__(self, max_concurrent: int = 32, default_per_app: int = 8,
+                 default_queue_depth: int = 64, max_queued: int = 1024,
+                 on_wait: Optional[Callable[[str, float], None]] = None,
+                 on_reject: Optional[Callable[[str], None]] = None):
+        self.max_concurrent = max_concurrent
+        self.on_wait = on_wait
+        self.on_reject = on_reject
+        self.default_per_app = default_per_app
+        self.default_queue_depth = default_queue_depth
+        self.max_queued = max_queued
+        self._queues = defaultdict(deque)
+        self._running = defaultdict(int)
+        self._total_running = 0
+        self._total_queued = 0
+        self._config = {}
+        self._finish_tags = defaultdict(float)
+        self._virtual_time = 0.0
+        self._durations = {}
+        self._waits = defaultdict(lambda: deque(maxlen=1000))
+        self._rejected = defaultdict(int)
+
+    def app_config(self, settings: dict) -> dict:
+        """
+        Returns the scheduling options of an application, with defaults filled in.
+
+        Args:
+            settings (dict): Settings of the application.
+
+        Returns:
+            dict: "weight", "max_concurrency" and "max_queue" of the application.
+        """
+        parent_settings = settings.get("parent_settings", {})
+        scheduling = parent_settings.get("scheduling") or {}
+        return {
+            "weight": max(float(scheduling.get("weight", 1)), 1e-3),
+            "max_concurrency": int(scheduling.get(
+                "max_concurrency", parent_settings.get("max_concurrency", self.default_per_app))),
+            "max_queue": int(scheduling.get("max_queue", self.default_queue_depth)),
+        }
+
+    @asynccontextmanager
+    async def slot(self, app_id: str, settings: dict):
+        """
+        Waits for the turn of a run of the application and holds its slot.
+
+        Args:
+            app_id (str): The name of the application.
+            settings (dict): Settings of the application.
+
+        Raises:
+            SchedulerFull: When the queue of the application or of the worker is full.
+        """
+        config = self._config[app_id] = self.app_config(settings)
+        queue = self._queues[app_id]
+        enqueued = time.monotonic()
+
+        if not queue and self._has_room(app_id):
+            self._finish_tags[app_id] = max(self._virtual_time, self._finish_tags[app_id]) + 1 / config["weight"]
+            self._admit(app_id)
+        else:
+            if len(queue) >= config["max_queue"] or self._total_queued >= self.max_queued:
+                self._rejected[app_id] += 1
+                if self.on_reject is not None:
+                    self.on_reject(app_id)
+                retry_after = self.retry_after(app_id)
+                self._prune(app_id)
+                raise SchedulerFull(app_id, retry_after)
+
+            tag = max(self._virtual_time, self._finish_tags[app_id]) + 1 / config["weight"]
+            self._finish_tags[app_id] = tag
+            waiter = asyncio.get_running_loop().create_future()
+            queue.append((tag, waiter))
+            self._total_queued += 1
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # The slot was granted just before the cancellation, hand it on
+                    self._release(app_id, None)
+                else:
+                    self._remove(app_id, waiter)
+                raise
+
+        started = time.monotonic()
+        self._waits[app_id].append(started - enqueued)
+        if self.on_wait is not None:
+            self.on_wait(app_id, started - enqueued)
+        try:
+            yield
+        finally:
+            self._release(app_id, time.monotonic() - started)
+
+    def retry_after(self, app_id: str) -> int:
+        """
+        Estimates when a rejected run of the application could be admitted.
+
+        Args:
+            app_id (str): The name of the application.
+
+        Returns:
+            int: Seconds, at least 1.
+        """
+        config = self._config.get(app_id) or self.app_config({})
+        duration = self._durations.get(app_id, 5.0)
+        waiting = len(self._queues.get(app_id, ())) + 1
+        return max(1, math.ceil(duration * waiting / max(config["max_concurrency"], 1)))
+
+    def stats(self) -> dict:
+        """
+        Returns the queue depth, runs in flight, rejections and queue-wait times per application.
+        """
+        apps = set(self._queues) | set(self._running) | set(self._waits) | set(self._rejected)
+        stats = {}
+        for app_id in apps:
+            waits = sorted(self._waits.get(app_id, ()))
+            stats[app_id] = {
+                "running": self._running.get(app_id, 0),
+                "queued": len(self._queues.get(app_id, ())),
+                "rejected": self._rejected.get(app_id, 0),
+                "queue_wait_avg": sum(waits) / len(waits) if waits else 0.0,
+                "queue_wait_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            }
+        return stats
+
+    def _has_room(self, app_id: str) -> bool:
+        return (self._total_running < self.max_concurrent
+                and self._running[app_id] < self._config[app_id]["max_concurrency"])
+
+    def _admit(self, app_id: str) -> None:
+        self._running[app_id] += 1
+        self._total_running += 1
+
+    def _release(self, app_id: str, duration) -> None:
+        self._running[app_id] -= 1
+        self._total_running -= 1
+        if duration is not None:
+            # Exponential moving average of the run time, used to compute Retry-After
+            previous = self._durations.get(app_id, duration)
+            self._durations[app_id] = 0.8 * previous + 0.2 * duration
+        self._dispatch()
+        self._prune(app_id)
+
+    def _remove(self, app_id: str, waiter) -> None:
+        queue = self._queues[app_id]
+        for entry in queue:
+            if entry[1] is waiter:
+                queue.remove(entry)
+                self._total_queued -= 1
+                break
+        self._prune(app_id)
+
+    def _prune(self, app_id: str) -> None:
+        """
+        Drops the queue and virtual time of an application that has no run in flight or waiting.
+        """
+        if self._running.get(app_id) or self._queues.get(app_id):
+            return
+        for state in (self._queues, self._running, self._config, self._finish_tags):
+            state.pop(app_id, None)
+
+    def _dispatch(self) -> None:
+        """
+        Starts waiting runs, smallest finish tag first, while slots are free.
+        """
+        while self._total_running < self.max_concurrent:
+            best = None
+            for app_id, queue in self._queues.items():
+                if queue and self._has_room(app_id) and (best is None or queue[0][0] < best[0]):
+                    best = (queue[0][0], app_id)
+            if best is None:
+                return
+
+            tag, app_id = best
+            _, waiter = self._queues[app_id].popleft()
+            self._total_queued -= 1
+            if waiter.done():
+                continue
+            self._virtual_time = max(self._virtual_time, tag - 1 / self._config[app_id]["weight"])
+            self._admit(app_id)
+            waiter.set_result(None)
@@ -1,3 +1,5 @@
+from typing import Optional
+
 from  pydantic import BaseModel
 class QueryInput(BaseModel):
     """
@@ -6,9 +8,11 @@ class QueryInput(BaseModel):
     Attributes:
         session_id (str): The unique identifier for the session.
         query (str): The text of the query.
+        request_id (str, optional): Identifier of a WebSocket request, used to cancel it.
     """
     session_id: str  # Unique identifier for the session
     query: str  # Text of the query
+    request_id: Optional[str] = None  # Identifier of a WebSocket request
 
 class SettingsInput(BaseModel):
     """
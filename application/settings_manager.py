@@ -1,9 +1,15 @@
 import json
+import hashlib
 import os
+import asyncio
 
 import redis 
 from dotenv import load_dotenv
 import redis.client
+import redis.asyncio
+
+from source.cache import TTLCache
+from logger import logging
 
 # Path to the .env file
 dotenv_path = os.path.join(os.path.dirname(__file__), "../.env")
@@ -15,19 +21,139 @@ os.environ.clear()
 load_dotenv(dotenv_path)
 
 redis_client = redis.Redis.from_url(os.environ.get("REDIS_URL"), decode_responses=True)
+async_redis_client = redis.asyncio.Redis.from_url(os.environ.get("REDIS_URL"), decode_responses=True)
+
+# Channel on which workers announce the app_id of replaced settings
+SETTINGS_CHANNEL = os.environ.get("SETTINGS_CHANNEL", "settings:invalidate")
+
+# In-process cache of parsed settings, the TTL only bounds staleness if an invalidation is missed
+settings_cache = TTLCache(
+    maxsize=int(os.environ.get("SETTINGS_CACHE_SIZE", 256)),
+    ttl=float(os.environ.get("SETTINGS_CACHE_TTL", 60)),
+)
+
+# Callbacks notified with the app_id whenever its settings are replaced, or None for every app_id
+settings_listeners = []
+
+def on_settings_change(callback):
+    """
+    Registers a callback that is called with the app_id after its settings change.
+
+    The callback is called with None when the settings of any application may
+    have changed, e.g. after invalidations were missed.
+
+    Args:
+        callback (callable): Function receiving the app_id whose settings were written, or None.
+    """
+    settings_listeners.append(callback)
 
 def insert_settings(app_id: str, new_settings: dict):
 
     # Convert settings dictionary to JSON string
     setttings_json= json.dumps(new_settings)
 
-    # Insert JSON string in Reddis with app_id as the key
-    redis_client.set(app_id, setttings_json)
+    # Insert JSON string in Reddis with app_id as the key and tell every worker about it
+    pipe = redis_client.pipeline()
+    pipe.set(app_id, setttings_json)
+    pipe.publish(SETTINGS_CHANNEL, app_id)
+    pipe.execute()
+
+    invalidate_settings(app_id)
+
+def invalidate_settings(app_id: str):
+    """
+    Drops the cached settings of an application and notifies the listeners.
+
+    Args:
+        app_id (str): The name of the application.
+    """
+    settings_cache.pop(app_id)
+
+    # Let dependent caches drop anything built from the old settings
+    for callback in settings_listeners:
+        callback(app_id)
+
+def invalidate_all_settings():
+    """
+    Drops the cached settings of every application and notifies the listeners.
+    """
+    settings_cache.clear()
+    for callback in settings_listeners:
+        callback(None)
 
 def fetch_settings(app_id: str) -> dict:
-    settings= redis_client.get(app_id)
-    if settings:
-        return json.loads(settings)
+    """
+    Returns the settings of an application, reading Redis only on a cache miss.
+
+    The returned dictionary is shared with the cache and must not be modified.
+
+    Args:
+        app_id (str): The name of the application.
+
+    Returns:
+        dict: The settings, empty when none are stored.
+    """
+    settings = settings_cache.get(app_id)
+    if settings is None:
+        settings = _parse_settings(redis_client.get(app_id))
+        settings_cache.set(app_id, settings)
+    return settings
+
+async def afetch_settings(app_id: str) -> dict:
+    """
+    Async variant of fetch_settings that does not block the event loop on a cache miss.
+
+    Args:
+        app_id (str): The name of the application.
+
+    Returns:
+        dict: The settings, empty when none are stored.
+    """
+    settings = settings_cache.get(app_id)
+    if settings is None:
+        settings = _parse_settings(await async_redis_client.get(app_id))
+        settings_cache.set(app_id, settings)
+    return settings
+
+def settings_hash(settings: dict) -> str:
+    """
+    Computes a stable hash of a settings document.
+
+    Args:
+        settings (dict): Settings of the application.
+
+    Returns:
+        str: Hex digest identifying this version of the settings.
+    """
+    settings_json = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(settings_json.encode("utf-8")).hexdigest()
+
+def _parse_settings(settings_json) -> dict:
+    if settings_json:
+        return json.loads(settings_json)
     return {}
 
+async def listen_for_settings_changes():
+    """
+    Drops cached settings whenever any worker publishes an update.
+
+    Runs until cancelled. After a lost connection the settings of every
+    application are invalidated, since updates may have been missed while disconnected.
+    """
+    while True:
+        pubsub = async_redis_client.pubsub()
+        try:
+            await pubsub.subscribe(SETTINGS_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    invalidate_settings(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning("Settings invalidation listener failed, reconnecting: %s", e)
+            invalidate_all_settings()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.close()
+
 
@@ -1,38 +1,137 @@
+import asyncio
+import os
+from collections import defaultdict
+
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
-from typing import List
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
 from fastapi.websockets import WebSocketState
 
+from logger import logging
+from metrics import observe
+
+
+# Frames buffered per streamed response before the agent run is paused
+STREAM_BUFFER_SIZE = int(os.environ.get("WS_STREAM_BUFFER_SIZE", 256))
+
+# Seconds a single send may take before the connection is considered stalled
+SEND_TIMEOUT = float(os.environ.get("WS_SEND_TIMEOUT", 5))
+
+# Requests a connection may have in flight at the same time
+MAX_REQUESTS_PER_CONNECTION = int(os.environ.get("WS_MAX_REQUESTS_PER_CONNECTION", 4))
 
 # WebSocket endpoint
 
 class ConnectionManager:
     """
-    Manages WebSocket connections.
+    Manages WebSocket connections and the requests running on them.
+
+    Connections are indexed by application and by session, so targeted sends
+    and disconnects do not scan every connection. Each request of a connection
+    runs as its own task and can be cancelled by its request id.
 
     Attributes:
-        active_connections (List[WebSocket]): List of active WebSocket connections.
+        active_connections (Set[WebSocket]): The active WebSocket connections.
+        by_app (Dict[str, Set[WebSocket]]): Connections per application.
+        by_session (Dict[str, Set[WebSocket]]): Connections per session.
+        tasks (Dict[WebSocket, Dict[str, asyncio.Task]]): Running requests per connection.
     """
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Set[WebSocket] = set()
+        self.by_app: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.by_session: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.tasks: Dict[WebSocket, Dict[str, asyncio.Task]] = {}
+        self._app_of: Dict[WebSocket, str] = {}
+        self._sessions_of: Dict[WebSocket, Set[str]] = defaultdict(set)
+        self._send_locks: Dict[WebSocket, asyncio.Lock] = {}
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, app_id: Optional[str] = None):
         """
-        Accepts a new WebSocket connection and adds it to the active connections list.
+        Accepts a new WebSocket connection and adds it to the active connections.
 
         Args:
             websocket (WebSocket): The WebSocket connection to accept.
+            app_id (str, optional): The application the connection belongs to.
         """
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.add(websocket)
+        self.tasks[websocket] = {}
+        self._send_locks[websocket] = asyncio.Lock()
+        if app_id is not None:
+            self._app_of[websocket] = app_id
+            self.by_app[app_id].add(websocket)
+
+    def bind_session(self, websocket: WebSocket, session_id: str):
+        """
+        Indexes a connection under a session it sent a request for.
+
+        Args:
+            websocket (WebSocket): The WebSocket connection.
+            session_id (str): The session of the request.
+        """
+        if websocket in self.active_connections:
+            self.by_session[session_id].add(websocket)
+            self._sessions_of[websocket].add(session_id)
 
     def disconnect(self, websocket: WebSocket):
         """
-        Removes a WebSocket connection from the active connections list.
+        Removes a WebSocket connection from every index and cancels its running requests.
 
         Args:
             websocket (WebSocket): The WebSocket connection to remove.
         """
-        self.active_connections.remove(websocket)
+        self.active_connections.discard(websocket)
+        for task in self.tasks.pop(websocket, {}).values():
+            task.cancel()
+        self._send_locks.pop(websocket, None)
+
+        app_id = self._app_of.pop(websocket, None)
+        if app_id is not None:
+            self._discard(self.by_app, app_id, websocket)
+        for session_id in self._sessions_of.pop(websocket, set()):
+            self._discard(self.by_session, session_id, websocket)
+
+    def start_request(self, websocket: WebSocket, request_id: str, request: Awaitable) -> bool:
+        """
+        Runs a request of a connection as a cancellable task.
+
+        Args:
+            websocket (WebSocket): The WebSocket connection.
+            request_id (str): Identifier of the request, used to cancel it.
+            request (Awaitable): The coroutine handling the request.
+
+        Returns:
+            bool: False when the connection already runs the maximum number of requests
+                or a request with the same id, in which case the request is not started.
+        """
+        tasks = self.tasks.get(websocket)
+        if tasks is None or request_id in tasks or len(tasks) >= MAX_REQUESTS_PER_CONNECTION:
+            request.close()
+            return False
+
+        task = asyncio.create_task(request)
+        tasks[request_id] = task
+        task.add_done_callback(lambda _: tasks.pop(request_id, None))
+        return True
+
+    def cancel_request(self, websocket: WebSocket, request_id: Optional[str] = None) -> int:
+        """
+        Cancels a running request of a connection, or all of them when no id is given.
+
+        Cancelling the task closes the agent stream, which aborts the pending LLM
+        and async tool calls. Sync tools already running on a thread finish in the background.
+
+        Args:
+            websocket (WebSocket): The WebSocket connection.
+            request_id (str, optional): The request to cancel.
+
+        Returns:
+            int: Number of requests cancelled.
+        """
+        tasks = self.tasks.get(websocket, {})
+        targets = list(tasks.values()) if request_id is None else [tasks[request_id]] if request_id in tasks else []
+        for task in targets:
+            task.cancel()
+        return len(targets)
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
         """
@@ -41,19 +140,138 @@ class ConnectionManager:
         Args:
             message (str): The message to send.
             websocket (WebSocket): The WebSocket connection to send the message to.
+
+        Raises:
+            asyncio.TimeoutError: When the send takes longer than WS_SEND_TIMEOUT.
         """
-        if websocket.application_state == WebSocketState.CONNECTED:
-            await websocket.send_text(message)
-        # await websocket.send_text(message)
+        if websocket.application_state == WebSocketState.CONNECTED and websocket in self.active_connections:
+            await self._send(websocket, websocket.send_text, message)
 
-    async def broadcast(self, message: str):
+    async def send_json(self, frame: dict, websocket: WebSocket):
         """
-        Broadcasts a message to all active WebSocket connections.
+        Sends a JSON frame to a specific WebSocket connection.
+
+        Sends of concurrent requests of the same connection are serialized.
+
+        Args:
+            frame (dict): The frame to send.
+            websocket (WebSocket): The WebSocket connection to send the frame to.
+
+        Raises:
+            asyncio.TimeoutError: When the send takes longer than WS_SEND_TIMEOUT.
+        """
+        if websocket.application_state == WebSocketState.CONNECTED and websocket in self.active_connections:
+            with observe("ws_send"):
+                await self._send(websocket, websocket.send_json, frame)
+
+    async def stream(self, frames: AsyncIterator[dict], websocket: WebSocket, max_buffer: int = None):
+        """
+        Sends a stream of JSON frames, buffering at most max_buffer frames for a slow client.
+
+        The frames are produced in a separate task into a bounded queue. When the
+        client falls behind and the queue is full, the producer waits; the agent
+        run goes on and its remaining frames, at most one per token of the
+        answer, wait in its own frame queue.
+
+        Args:
+            frames (AsyncIterator[dict]): The frames to send.
+            websocket (WebSocket): The WebSocket connection to send the frames to.
+            max_buffer (int, optional): Maximum number of frames waiting to be sent.
+        """
+        queue = asyncio.Queue(maxsize=max_buffer or STREAM_BUFFER_SIZE)
+        done = object()
+
+        async def produce():
+            try:
+                async for frame in frames:
+                    await queue.put(frame)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await queue.put(done)
+                raise
+            finally:
+                # Stops the agent run when the client is gone
+                if hasattr(frames, "aclose"):
+                    await frames.aclose()
+            await queue.put(done)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                frame = await queue.get()
+                if frame is done:
+                    break
+                await self.send_json(frame, websocket)
+            await producer
+        finally:
+            producer.cancel()
+
+    async def broadcast(self, message: str, app_id: Optional[str] = None, session_id: Optional[str] = None,
+                        timeout: float = None):
+        """
+        Broadcasts a message to the active WebSocket connections, concurrently.
+
+        Each send is bounded by a timeout, so one slow socket cannot stall the
+        others; connections whose send fails or times out are disconnected.
 
         Args:
             message (str): The message to broadcast.
+            app_id (str, optional): Only send to the connections of this application.
+            session_id (str, optional): Only send to the connections of this session.
+            timeout (float, optional): Seconds allowed per send, defaults to WS_SEND_TIMEOUT.
+        """
+        if session_id is not None:
+            targets = set(self.by_session.get(session_id, ()))
+        elif app_id is not None:
+            targets = set(self.by_app.get(app_id, ()))
+        else:
+            targets = set(self.active_connections)
+        if app_id is not None:
+            targets &= self.by_app.get(app_id, set())
+        targets = list(targets)
+
+        timeout = SEND_TIMEOUT if timeout is None else timeout
+        results = await asyncio.gather(
+            *(asyncio.wait_for(self.send_personal_message(message, connection), timeout) for connection in targets),
+            return_exceptions=True,
+        )
+        for connection, result in zip(targets, results):
+            if isinstance(result, BaseException):
+                logging.warning("Dropping WebSocket connection after failed broadcast: %r", result)
+                self.disconnect(connection)
+
+    async def _send(self, websocket: WebSocket, send: Callable[[Any], Awaitable], payload: Any):
+        """
+        Runs a send under the lock of its connection, bounded by WS_SEND_TIMEOUT.
+
+        A client that stops reading would otherwise hold its requests, and their
+        scheduler slots, for as long as it stays stalled; on timeout the connection
+        is dropped, which cancels its requests.
         """
-        for connection in self.active_connections:
-            await connection.send_text(message)
+        async def locked():
+            async with self._send_lock(websocket):
+                await send(payload)
+
+        try:
+            await asyncio.wait_for(locked(), SEND_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("WebSocket send stalled for %ss, dropping the connection", SEND_TIMEOUT)
+            self.disconnect(websocket)
+            raise
+
+    def _send_lock(self, websocket: WebSocket) -> asyncio.Lock:
+        lock = self._send_locks.get(websocket)
+        if lock is None:
+            lock = self._send_locks[websocket] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def _discard(index: Dict[str, Set[WebSocket]], key: str, websocket: WebSocket):
+        connections = index.get(key)
+        if connections is not None:
+            connections.discard(websocket)
+            if not connections:
+                del index[key]
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
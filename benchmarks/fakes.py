@@ -0,0 +1,375 @@
+"""
+Local stand-ins for the external services of the API, used by the benchmarks.
+
+- FakeChatModel: a deterministic chat model with a configurable latency per
+  token. When tools are bound and the turn has no tool result yet it calls the
+  first tool with the question, otherwise it streams a fixed-length answer.
+- FakeEmbeddings: deterministic hashed bag-of-words embeddings.
+- start_fake_serper: an HTTP server answering like the Serper search API.
+- install_fakes: points the service modules at the stand-ins and at an
+  in-memory fakeredis server, or at a local Redis.
+
+Nothing here reaches OpenAI, Serper, the LangChain hub or Elasticsearch.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import numpy as np
+from aiohttp import web
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.language_models.chat_models import agenerate_from_stream, generate_from_stream
+from langchain_core.messages import AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder, PromptTemplate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORDS = ("the", "museum", "opens", "at", "nine", "and", "closes", "at", "five", "on", "weekdays")
+
+AGENT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a helpful assistant. Use the tools to answer."),
+    MessagesPlaceholder("chat_history", optional=True),
+    ("human", "{input}"),
+    MessagesPlaceholder("agent_scratchpad"),
+])
+
+SEARCH_PROMPT = PromptTemplate.from_template(
+    "Answer the question from the search results.\n\nResults: {context}\n\nQuestion: {question}"
+)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model with a configurable latency.
+
+    Attributes:
+        first_token_latency (float): Seconds before the first token.
+        token_latency (float): Seconds between two tokens.
+        answer_tokens (int): Number of tokens of every answer.
+    """
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    answer_tokens: int = 40
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark-chat"
+
+    def _chunks(self, messages: List[BaseMessage], **kwargs: Any) -> Iterator[AIMessageChunk]:
+        tools = kwargs.get("tools") or []
+        last_human = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=-1)
+        called = any(isinstance(m, ToolMessage) for m in messages[last_human + 1:])
+        if tools and not called:
+            question = messages[last_human].content if last_human >= 0 else ""
+            yield AIMessageChunk(content="", additional_kwargs={"tool_calls": [{
+                "index": 0,
+                "id": "call_" + hashlib.md5(str(question).encode("utf-8")).hexdigest()[:12],
+                "type": "function",
+                "function": {"name": tools[0]["function"]["name"], "arguments": json.dumps({"question": question})},
+            }]})
+            return
+        for i in range(self.answer_tokens):
+            yield AIMessageChunk(content=WORDS[i % len(WORDS)] + " ")
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_latency)
+        for i, chunk in enumerate(self._chunks(messages, **kwargs)):
+            if i:
+                time.sleep(self.token_latency)
+            if run_manager and chunk.content:
+                run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_latency)
+        for i, chunk in enumerate(self._chunks(messages, **kwargs)):
+            if i:
+                await asyncio.sleep(self.token_latency)
+            if run_manager and chunk.content:
+                await run_manager.on_llm_new_token(chunk.content, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return generate_from_stream(self._stream(messages, stop, run_manager, **kwargs))
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic hashed bag-of-words embeddings with a configurable latency per request.
+
+    Attributes:
+        size (int): Dimension of the vectors.
+        latency (float): Seconds per embedding request.
+    """
+    def __init__(self, size: int = 256, latency: float = 0.0):
+        self.size = size
+        self.latency = latency
+        self.model = f"fake-embeddings-{size}"
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in text.lower().split():
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest(), 16) % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        await asyncio.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+def fake_serper_app(latency: float = 0.0) -> web.Application:
+    """
+    Builds an aiohttp application answering POST /search like the Serper API.
+
+    Args:
+        latency (float): Seconds to wait before answering.
+
+    Returns:
+        web.Application: The fake Serper application.
+    """
+    async def search(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        query = request.query.get("q", "")
+        return web.json_response({
+            "searchParameters": {"q": query, "type": "search"},
+            "organic": [
+                {
+                    "title": f"Result {i} for {query}",
+                    "link": f"https://example.com/{i}",
+                    "snippet": f"Snippet {i}: " + " ".join(WORDS),
+                }
+                for i in range(5)
+            ],
+        })
+
+    app = web.Application()
+    app.router.add_post("/{search_type}", search)
+    return app
+
+
+def start_fake_serper(port: int, latency: float = 0.0) -> threading.Thread:
+    """
+    Serves the fake Serper API on 127.0.0.1 from a daemon thread with its own event loop.
+
+    Args:
+        port (int): Port to listen on.
+        latency (float): Seconds to wait before answering.
+
+    Returns:
+        threading.Thread: The thread of the server, already listening.
+    """
+    ready = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(fake_serper_app(latency), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, name="fake-serper", daemon=True)
+    thread.start()
+    ready.wait()
+    return thread
+
+
+@contextmanager
+def keep_environment():
+    """
+    Keeps the environment of the process while the service modules are imported.
+
+    Several modules clear os.environ at import and reload the .env file of the
+    repository; the benchmark configures them through its own variables instead.
+    """
+    os.environ.clear = lambda: None
+    try:
+        yield
+    finally:
+        del os.environ.clear
+
+
+def use_fake_redis() -> None:
+    """
+    Routes every Redis client created from a URL to one in-memory fakeredis server.
+    """
+    import fakeredis
+    import fakeredis.aioredis
+    import redis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+
+    def sync_client(cls, *args, **kwargs):
+        return fakeredis.FakeRedis(server=server, decode_responses=kwargs.get("decode_responses", False))
+
+    def async_client(cls, *args, **kwargs):
+        return fakeredis.aioredis.FakeRedis(server=server, decode_responses=kwargs.get("decode_responses", False))
+
+    redis.Redis.from_url = classmethod(sync_client)
+    redis.asyncio.Redis.from_url = classmethod(async_client)
+
+    # The chat history builds its clients from connection pools
+    import chat_history
+    chat_history._redis_client = fakeredis.FakeRedis(server=server)
+    chat_history._async_redis_client = fakeredis.aioredis.FakeRedis(server=server)
+
+
+def use_fake_serper(url: str) -> None:
+    """
+    Sends the Serper requests of the search tools to a fake server.
+
+    Args:
+        url (str): Base URL of the fake Serper server.
+    """
+    import aiohttp
+    import requests
+    from langchain_community.utilities import GoogleSerperAPIWrapper
+
+    def results(self, search_term: str, search_type: str = "search", **kwargs: Any) -> dict:
+        response = requests.post(f"{url}/{search_type}", params={"q": search_term})
+        response.raise_for_status()
+        return response.json()
+
+    async def aresults(self, search_term: str, search_type: str = "search", **kwargs: Any) -> dict:
+        if self.aiosession is None:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(f"{url}/{search_type}", params={"q": search_term}) as response:
+                    return await response.json()
+        async with self.aiosession.post(f"{url}/{search_type}", params={"q": search_term},
+                                        raise_for_status=True) as response:
+            return await response.json()
+
+    GoogleSerperAPIWrapper._google_serper_api_results = results
+    GoogleSerperAPIWrapper._async_google_serper_search_results = aresults
+
+
+def install_fakes(serper_url: str, redis_url: Optional[str] = None, first_token_latency: float = 0.0,
+                  token_latency: float = 0.0, answer_tokens: int = 40, embedding_latency: float = 0.0):
+    """
+    Imports the API with its OpenAI, hub, Serper and Redis clients replaced by stand-ins.
+
+    Args:
+        serper_url (str): Base URL of the fake Serper server.
+        redis_url (str, optional): A local Redis to use instead of fakeredis.
+        first_token_latency (float): Seconds before the first token of every LLM call.
+        token_latency (float): Seconds between two tokens of an LLM call.
+        answer_tokens (int): Number of tokens of every LLM answer.
+        embedding_latency (float): Seconds per embedding request.
+
+    Returns:
+        module: The application.api module.
+    """
+    import sys
+
+    for path in ("configuration", "application", "source", ""):
+        sys.path.insert(0, os.path.join(ROOT, path))
+
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ.setdefault("SERPER_API_KEY", "benchmark")
+    os.environ["REDIS_URL"] = redis_url or "redis://localhost:6379/0"
+
+    with keep_environment():
+        if not redis_url:
+            use_fake_redis()
+        import database_setup
+        import prompt_cache
+        import summarization
+        import utils
+        from application import api
+        from source import database_setup as source_database_setup
+        from source import summarization as source_summarization
+        from source import utils as source_utils
+
+    def chat_model(**kwargs):
+        return FakeChatModel(first_token_latency=first_token_latency, token_latency=token_latency,
+                             answer_tokens=answer_tokens, callbacks=kwargs.get("callbacks"))
+
+    def embeddings(**kwargs):
+        return FakeEmbeddings(latency=embedding_latency)
+
+    # The factories are cached and build their clients on first use, so replacing
+    # the client classes they call is enough
+    for module in (utils, source_utils):
+        module.setup_model = lambda: chat_model(callbacks=[utils.MetricsCallbackHandler()])
+    for module in (summarization, source_summarization):
+        module.ChatOpenAI = chat_model
+        module.OpenAIEmbeddings = embeddings
+    for module in (database_setup, source_database_setup):
+        module.OpenAIEmbeddings = embeddings
+
+    prompts = {"benchmark/agent": AGENT_PROMPT, "benchmark/search": SEARCH_PROMPT}
+    prompt_cache.prompt_cache.get = lambda prompt_id, ttl=None: prompts[prompt_id]
+
+    use_fake_serper(serper_url)
+    return api
+
+
+def benchmark_settings(website_url: str = "example.com", max_concurrency: int = 8, max_queue: int = 64) -> dict:
+    """
+    Returns the settings of the benchmark application.
+
+    Args:
+        website_url (str): Site the web search tool is restricted to.
+        max_concurrency (int): Agent runs of the application in flight at once.
+        max_queue (int): Agent runs of the application waiting for a slot.
+
+    Returns:
+        dict: Settings in the format stored by POST /settings/{app_id}.
+    """
+    return {
+        "parent_settings": {
+            "agent_id": "benchmark/agent",
+            "tool_id": "jordan",
+            "tools": ["wb_tool", "azal_database_tool"],
+            "scheduling": {"max_concurrency": max_concurrency, "max_queue": max_queue},
+        },
+        "Tools": {
+            "wb_tool": {"prompt_id": "benchmark/search", "website_url": website_url},
+            "azal_database_tool": {"index_name": "benchmark_activities", "backend": "local", "k": 4},
+        },
+    }
+
+
+def seed_vector_store(path: str, count: int = 1000, embedding_latency: float = 0.0) -> None:
+    """
+    Writes a local vector store of synthetic activities for the database tool.
+
+    Args:
+        path (str): Directory of the local stores, the index is benchmark_activities.
+        count (int): Number of documents.
+        embedding_latency (float): Seconds per embedding request.
+    """
+    from local_vector_store import LocalVectorStore
+
+    store = LocalVectorStore(os.path.join(path, "benchmark_activities"), FakeEmbeddings(latency=embedding_latency))
+    texts = [f"Activity {i}: " + " ".join(WORDS[i % len(WORDS):] + WORDS[:i % len(WORDS)]) for i in range(count)]
+    store.add_texts(texts, metadatas=[{"activity_id": i} for i in range(count)])
@@ -0,0 +1,360 @@
+"""
+Load-tests /invoke, /ws/invoke and /summarize offline, against local stand-ins.
+
+Boots application.api:app under uvicorn in a child process whose OpenAI, hub,
+Serper, Redis and Elasticsearch clients are replaced by the fakes of
+benchmarks/fakes.py: a deterministic chat model with a configurable token
+latency, a fake Serper HTTP server, fakeredis (or a local Redis with
+--redis-url) and a local vector store. Each endpoint is then driven by a
+closed loop of clients at every concurrency level, and the throughput, the
+p50/p95/p99 latency and, for streamed responses, the time to first token are
+written as JSON so runs can be compared.
+
+Every agent turn makes two LLM calls (the tool call and the answer), one web
+search and one summarizing chain call. Queries are unique unless
+--distinct-queries is set, so the search cache and request coalescing do not
+serve them. Install the benchmark dependencies, fakeredis and a WebSocket
+library for uvicorn, with pip install -r requirements-dev.txt.
+
+Usage:
+    python benchmarks/load_test.py --concurrency 1 8 32 --requests 200 --output results.json
+    python benchmarks/load_test.py --endpoints invoke --token-latency 0.02 --serper-latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakes import start_fake_serper
+
+ENDPOINTS = ("invoke", "ws", "summarize")
+
+# The agent reports its own failures as an answer instead of an error status
+AGENT_ERROR = "Internal Error"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(args) -> None:
+    """
+    Runs the API with the fakes installed, in the child process.
+    """
+    import uvicorn
+
+    from fakes import benchmark_settings, install_fakes, seed_vector_store
+
+    api = install_fakes(
+        serper_url=args.serper_url,
+        redis_url=args.redis_url,
+        first_token_latency=args.first_token_latency,
+        token_latency=args.token_latency,
+        answer_tokens=args.answer_tokens,
+        embedding_latency=args.embedding_latency,
+    )
+    from application.settings_manager import insert_settings
+    from chat_history import PooledRedisChatMessageHistory
+    from langchain_core.messages import AIMessage, HumanMessage
+
+    seed_vector_store(os.environ["LOCAL_VECTOR_DIR"])
+    insert_settings(args.app_id, benchmark_settings(
+        max_concurrency=args.app_max_concurrency, max_queue=args.app_max_queue))
+
+    # Histories of the sessions summarized by the /summarize benchmark
+    topics = ("opening hours", "tickets", "parking", "guided tours", "the cafe", "accessibility", "exhibitions")
+    for i in range(args.summary_sessions):
+        messages = []
+        for j in range(args.summary_turns):
+            topic = topics[j % len(topics)]
+            messages.append(HumanMessage(f"Question {j}: what should I know about {topic}? " * 3))
+            messages.append(AIMessage(f"Answer {j}: here is what we offer regarding {topic}. " * 3))
+        PooledRedisChatMessageHistory(session_id=f"bench-summary-{i}").add_messages(messages)
+
+    uvicorn.run(api.app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+def start_server(args, serper_url: str, workdir: str) -> subprocess.Popen:
+    """
+    Starts the API in a child process and waits until it answers.
+    """
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve",
+        "--port", str(args.port),
+        "--serper-url", serper_url,
+        "--app-id", args.app_id,
+        "--first-token-latency", str(args.first_token_latency),
+        "--token-latency", str(args.token_latency),
+        "--answer-tokens", str(args.answer_tokens),
+        "--embedding-latency", str(args.embedding_latency),
+        "--app-max-concurrency", str(args.app_max_concurrency),
+        "--app-max-queue", str(args.app_max_queue),
+        "--summary-sessions", str(args.summary_sessions),
+        "--summary-turns", str(args.summary_turns),
+    ]
+    if args.redis_url:
+        command += ["--redis-url", args.redis_url]
+
+    env = dict(os.environ)
+    env.update({
+        "LOCAL_VECTOR_DIR": os.path.join(workdir, "vectors"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embeddings"),
+        "PROMPT_CACHE_DIR": os.path.join(workdir, "prompts"),
+    })
+    # Logs and caches written relative to the working directory stay out of the repository
+    server = subprocess.Popen(command, cwd=workdir, env=env)
+
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The API exited during startup with code {server.returncode}")
+        try:
+            with socket.create_connection(("127.0.0.1", args.port), timeout=0.5):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"The API did not start within {args.startup_timeout}s")
+
+
+class Scenario:
+    """
+    Issues requests to one endpoint and records their latency.
+
+    Attributes:
+        endpoint (str): "invoke", "ws" or "summarize".
+        base_url (str): URL of the API.
+        app_id (str): Application the requests are made for.
+        distinct_queries (int): Number of distinct queries, 0 for a new query per request.
+        summary_sessions (int): Number of seeded sessions to summarize.
+    """
+    def __init__(self, endpoint: str, base_url: str, app_id: str, distinct_queries: int, summary_sessions: int):
+        self.endpoint = endpoint
+        self.base_url = base_url
+        self.app_id = app_id
+        self.distinct_queries = distinct_queries
+        self.summary_sessions = summary_sessions
+
+    def query(self, i: int) -> str:
+        n = i % self.distinct_queries if self.distinct_queries else i
+        return f"When does exhibition {n} open?"
+
+    async def worker(self, http: aiohttp.ClientSession, worker_id: int, counter, samples: list):
+        """
+        Sends requests one after the other until the shared counter is exhausted.
+        """
+        session_id = f"bench-{uuid.uuid4().hex[:8]}-{worker_id}"
+        websocket = connect_error = None
+        if self.endpoint == "ws":
+            try:
+                websocket = await http.ws_connect(f"{self.base_url.replace('http', 'ws', 1)}/ws/invoke/{self.app_id}")
+            except Exception as e:
+                connect_error = e
+        try:
+            for i in counter:
+                start = time.perf_counter()
+                try:
+                    if connect_error is not None:
+                        raise connect_error
+                    if self.endpoint == "invoke":
+                        sample = await self.invoke(http, session_id, i)
+                    elif self.endpoint == "ws":
+                        sample = await self.ws_invoke(websocket, session_id, i)
+                    else:
+                        sample = await self.summarize(http, i)
+                except Exception as e:
+                    sample = {"status": "error", "error": repr(e)}
+                sample["latency"] = time.perf_counter() - start
+                if "first_token" in sample:
+                    sample["first_token"] -= start
+                samples.append(sample)
+        finally:
+            if websocket is not None:
+                await websocket.close()
+
+    async def invoke(self, http: aiohttp.ClientSession, session_id: str, i: int) -> dict:
+        payload = {"session_id": session_id, "query": self.query(i)}
+        async with http.post(f"{self.base_url}/invoke/{self.app_id}", json=payload) as response:
+            body = await response.json()
+        if response.status == 429:
+            return {"status": "rejected"}
+        if response.status != 200 or AGENT_ERROR in str(body.get("result", "")):
+            return {"status": "error", "error": str(body)[:200]}
+        return {"status": "ok"}
+
+    async def ws_invoke(self, websocket, session_id: str, i: int) -> dict:
+        request_id = str(i)
+        await websocket.send_json({"session_id": session_id, "query": self.query(i), "request_id": request_id})
+        sample = {}
+        while True:
+            frame = await websocket.receive_json()
+            if frame.get("request_id") != request_id:
+                continue
+            if frame["type"] == "token" and "first_token" not in sample:
+                sample["first_token"] = time.perf_counter()
+            elif frame["type"] == "final":
+                sample["status"] = "ok"
+                return sample
+            elif frame["type"] == "error":
+                sample["status"] = "rejected" if "retry_after" in frame else "error"
+                sample["error"] = frame.get("content", "")[:200]
+                return sample
+
+    async def summarize(self, http: aiohttp.ClientSession, i: int) -> dict:
+        payload = {"session_id": f"bench-summary-{i % self.summary_sessions}"}
+        sample = {"status": "ok"}
+        async with http.post(f"{self.base_url}/summarize/", json=payload) as response:
+            async for line in response.content:
+                if line.startswith(b"event: error"):
+                    sample["status"] = "error"
+                elif sample["status"] == "error" and line.startswith(b"data:"):
+                    sample["error"] = line[5:].decode().strip()[:200]
+                elif line.startswith(b"data:") and "first_token" not in sample:
+                    sample["first_token"] = time.perf_counter()
+        return sample
+
+    async def run(self, concurrency: int, requests: int) -> dict:
+        """
+        Runs the scenario with a fixed number of concurrent clients.
+
+        Args:
+            concurrency (int): Number of clients sending requests at the same time.
+            requests (int): Total number of requests.
+
+        Returns:
+            dict: Throughput, latency percentiles and request counts.
+        """
+        counter = iter(range(requests))
+        samples = []
+        connector = aiohttp.TCPConnector(limit=0)
+        timeout = aiohttp.ClientTimeout(total=None)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+            start = time.perf_counter()
+            await asyncio.gather(*(self.worker(http, w, counter, samples) for w in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+        ok = [s for s in samples if s["status"] == "ok"]
+        result = {
+            "endpoint": self.endpoint,
+            "concurrency": concurrency,
+            "requests": len(samples),
+            "ok": len(ok),
+            "rejected": sum(s["status"] == "rejected" for s in samples),
+            "errors": sum(s["status"] == "error" for s in samples),
+            "seconds": round(elapsed, 3),
+            "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": percentiles([s["latency"] for s in ok]),
+        }
+        first_tokens = [s["first_token"] for s in ok if "first_token" in s]
+        if first_tokens:
+            result["first_token_ms"] = percentiles(first_tokens)
+        failures = [s.get("error", "") for s in samples if s["status"] == "error"]
+        if failures:
+            result["first_error"] = failures[0]
+        return result
+
+
+def percentiles(seconds: list) -> dict:
+    """
+    Returns the mean and the p50/p95/p99 of durations, in milliseconds.
+    """
+    if not seconds:
+        return {}
+    values = np.asarray(seconds) * 1000
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+        "p99": round(float(np.percentile(values, 99)), 2),
+    }
+
+
+async def run_benchmarks(args, base_url: str) -> list:
+    results = []
+    for endpoint in args.endpoints:
+        scenario = Scenario(endpoint, base_url, args.app_id, args.distinct_queries, args.summary_sessions)
+        if args.warmup:
+            await scenario.run(1, args.warmup)
+        for concurrency in args.concurrency:
+            result = await scenario.run(concurrency, max(args.requests, concurrency))
+            results.append(result)
+            latency = result["latency_ms"]
+            print(f"{endpoint:>10} c={concurrency:<4} {result['throughput_rps']:>8.1f} req/s  "
+                  f"p50 {latency.get('p50', 0):>8.1f} ms  p95 {latency.get('p95', 0):>8.1f} ms  "
+                  f"p99 {latency.get('p99', 0):>8.1f} ms  ok {result['ok']}/{result['requests']}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--warmup", type=int, default=5, help="Sequential requests sent before measuring")
+    parser.add_argument("--distinct-queries", type=int, default=0, help="Cycle through this many queries, 0 for unique")
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="Seconds before the first LLM token")
+    parser.add_argument("--token-latency", type=float, default=0.01, help="Seconds between two LLM tokens")
+    parser.add_argument("--answer-tokens", type=int, default=40, help="Tokens of every LLM answer")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per embedding request")
+    parser.add_argument("--serper-latency", type=float, default=0.3, help="Seconds per Serper search")
+    parser.add_argument("--app-max-concurrency", type=int, default=8, help="Agent runs of the app in flight")
+    parser.add_argument("--app-max-queue", type=int, default=64, help="Agent runs of the app waiting for a slot")
+    parser.add_argument("--summary-sessions", type=int, default=20, help="Seeded sessions for /summarize")
+    parser.add_argument("--summary-turns", type=int, default=60, help="Turns in each seeded session")
+    parser.add_argument("--redis-url", help="Use this Redis instead of an in-memory fakeredis")
+    parser.add_argument("--app-id", default="benchmark", help="Application the requests are made for")
+    parser.add_argument("--port", type=int, default=0, help="Port of the API, a free one by default")
+    parser.add_argument("--startup-timeout", type=float, default=60)
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    # Used by the child process that runs the API
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--serper-url", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    args.port = args.port or free_port()
+    serper_port = free_port()
+    start_fake_serper(serper_port, args.serper_latency)
+
+    with tempfile.TemporaryDirectory(prefix="load-test-") as workdir:
+        server = start_server(args, f"http://127.0.0.1:{serper_port}", workdir)
+        try:
+            results = asyncio.run(run_benchmarks(args, f"http://127.0.0.1:{args.port}"))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("serve", "serper_url", "output")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Counts Redis round trips and connection pools per agent turn.
+
+Runs the same RunnableWithMessageHistory turn against the previous
+RedisChatMessageHistory and against PooledRedisChatMessageHistory, using an
+in-memory fakeredis server, and prints the counters of both. Under ainvoke
+the history is read with aget_messages but saved with the sync add_messages,
+which RunnableWithMessageHistory calls from its end listener.
+
+Usage:
+    python benchmarks/redis_round_trips.py --turns 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+
+sys.path.insert(1, "source")
+
+import fakeredis
+import fakeredis.aioredis
+import redis
+import redis.asyncio
+from langchain_community.chat_message_histories import RedisChatMessageHistory
+from langchain_core.runnables import RunnableLambda
+from langchain_core.runnables.history import RunnableWithMessageHistory
+
+import chat_history
+
+counters = {"round_trips": 0, "pools": 0}
+server = fakeredis.FakeServer()
+
+
+def count_round_trips():
+    """
+    Patches the Redis clients so every command or pipeline counts as one round trip.
+    """
+    execute_command = redis.Redis.execute_command
+    pipeline_execute = redis.client.Pipeline.execute
+    async_execute_command = redis.asyncio.Redis.execute_command
+    async_pipeline_execute = redis.asyncio.client.Pipeline.execute
+    pool_init = redis.ConnectionPool.__init__
+    async_pool_init = redis.asyncio.ConnectionPool.__init__
+
+    def counted_execute_command(self, *args, **kwargs):
+        counters["round_trips"] += 1
+        return execute_command(self, *args, **kwargs)
+
+    def counted_pipeline_execute(self, *args, **kwargs):
+        counters["round_trips"] += 1
+        return pipeline_execute(self, *args, **kwargs)
+
+    async def counted_async_execute_command(self, *args, **kwargs):
+        counters["round_trips"] += 1
+        return await async_execute_command(self, *args, **kwargs)
+
+    async def counted_async_pipeline_execute(self, *args, **kwargs):
+        counters["round_trips"] += 1
+        return await async_pipeline_execute(self, *args, **kwargs)
+
+    def counted_pool_init(self, *args, **kwargs):
+        counters["pools"] += 1
+        pool_init(self, *args, **kwargs)
+
+    def counted_async_pool_init(self, *args, **kwargs):
+        counters["pools"] += 1
+        async_pool_init(self, *args, **kwargs)
+
+    redis.Redis.execute_command = counted_execute_command
+    redis.client.Pipeline.execute = counted_pipeline_execute
+    redis.asyncio.Redis.execute_command = counted_async_execute_command
+    redis.asyncio.client.Pipeline.execute = counted_async_pipeline_execute
+    redis.ConnectionPool.__init__ = counted_pool_init
+    redis.asyncio.ConnectionPool.__init__ = counted_async_pool_init
+
+
+def use_fake_redis():
+    """
+    Points every Redis client at the shared in-memory fakeredis server.
+    """
+    redis.Redis.from_url = classmethod(lambda cls, *args, **kwargs: fakeredis.FakeRedis(server=server))
+    chat_history._redis_client = fakeredis.FakeRedis(server=server)
+    chat_history._async_redis_client = fakeredis.aioredis.FakeRedis(server=server)
+
+
+def build_runnable(get_history):
+    """
+    Wraps a stand-in for the agent executor in the same history runnable the agent uses.
+    """
+    agent = RunnableLambda(lambda inputs: {"output": f"answer to {inputs['input']}"})
+    return RunnableWithMessageHistory(
+        agent,
+        get_history,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    )
+
+
+def run_sync(name: str, get_history, turns: int) -> dict:
+    """
+    Runs a number of turns with invoke and returns the counters per turn.
+    """
+    runnable = build_runnable(get_history)
+    counters.update(round_trips=0, pools=0)
+    for turn in range(turns):
+        runnable.invoke({"input": f"question {turn}"}, {"configurable": {"session_id": name}})
+    return {key: value / turns for key, value in counters.items()}
+
+
+def run_async(name: str, get_history, turns: int) -> dict:
+    """
+    Runs a number of turns with ainvoke and returns the counters per turn.
+    """
+    runnable = build_runnable(get_history)
+    counters.update(round_trips=0, pools=0)
+
+    async def run():
+        for turn in range(turns):
+            await runnable.ainvoke({"input": f"question {turn}"}, {"configurable": {"session_id": name}})
+
+    asyncio.run(run())
+    return {key: value / turns for key, value in counters.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20, help="number of agent turns per backend")
+    args = parser.parse_args()
+
+    # Silence tracer warnings emitted by the stand-in agent runs
+    logging.disable(logging.WARNING)
+    os.environ.setdefault("REDIS_URL", "redis://localhost:6379/0")
+    use_fake_redis()
+    count_round_trips()
+
+    results = {
+        "RedisChatMessageHistory (invoke)": run_sync(
+            "legacy-sync",
+            lambda session_id: RedisChatMessageHistory(url=os.environ["REDIS_URL"], ttl=660, session_id=session_id),
+            args.turns,
+        ),
+        "PooledRedisChatMessageHistory (invoke)": run_sync(
+            "pooled-sync",
+            lambda session_id: chat_history.PooledRedisChatMessageHistory(session_id=session_id, ttl=660),
+            args.turns,
+        ),
+        "PooledRedisChatMessageHistory (ainvoke)": run_async(
+            "pooled-async",
+            lambda session_id: chat_history.PooledRedisChatMessageHistory(session_id=session_id, ttl=660),
+            args.turns,
+        ),
+    }
+
+    print(f"{'backend':<42}{'round trips/turn':>18}{'new pools/turn':>16}")
+    for name, result in results.items():
+        print(f"{name:<42}{result['round_trips']:>18.2f}{result['pools']:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Measures import time and resident memory of the service modules.
+
+Imports each module in a fresh interpreter started from the repository root,
+as the API workers do, and reports the wall time of the import and the peak
+resident set size of the process afterwards. The clients of the modules are
+built lazily, so nothing here should reach OpenAI, Elasticsearch, Redis or
+load the sentiment model.
+
+Usage:
+    python benchmarks/startup_time.py --repeats 5
+    python benchmarks/startup_time.py --modules application.api source.database_setup --json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_MODULES = [
+    "application.api",
+    "source.utils",
+    "source.database_setup",
+    "source.sentiment_analysis",
+    "source.summarization",
+]
+
+# Runs in the child interpreter, prints the import time and the peak RSS in MiB
+PROBE = """
+import resource, sys, time
+sys.path.insert(1, "source")
+sys.path.insert(2, "application")
+sys.path.insert(3, "configuration")
+start = time.perf_counter()
+__import__({module!r})
+elapsed = time.perf_counter() - start
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(elapsed * 1000, rss)
+"""
+
+
+def measure(module: str) -> tuple:
+    """
+    Imports a module in a new interpreter and returns (import ms, peak RSS MiB).
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module)],
+        cwd=ROOT, capture_output=True, text=True, check=False,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip()}")
+    elapsed, rss = result.stdout.strip().splitlines()[-1].split()
+    return float(elapsed), float(rss)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES, help="modules to import")
+    parser.add_argument("--repeats", type=int, default=3, help="fresh interpreters per module")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+
+    results = {}
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeats)]
+        results[module] = {
+            "import_ms": statistics.median(elapsed for elapsed, _ in runs),
+            "rss_mib": statistics.median(rss for _, rss in runs),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'module':<30}{'import ms':>12}{'peak RSS MiB':>15}")
+    for module, result in results.items():
+        print(f"{module:<30}{result['import_ms']:>12.0f}{result['rss_mib']:>15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Times representative-chunk selection of summarize() on synthetic histories.
+
+Compares the previous selection (full KMeans plus one np.linalg.norm per
+centroid in a Python loop) with select_representative_indices (MiniBatchKMeans
+for large inputs and a single distance-matrix/argmin pass) for the same number
+of clusters, on clustered random embeddings of 10 to 10,000 chunks.
+
+Usage:
+    python benchmarks/summarize_clustering.py --sizes 10 100 1000 10000 --dim 1536
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(1, "source")
+
+# The summarization module builds its OpenAI clients at import, no request is sent
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+os.environ.setdefault("SERPER_API_KEY", "benchmark")
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.datasets import make_blobs
+
+from summarization import choose_num_clusters, select_representative_indices
+
+
+def previous_selection(vectors, num_clusters: int) -> list:
+    """
+    The selection summarize() used before, generalized to num_clusters.
+    """
+    kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init='auto').fit(vectors)
+    closest_indices = []
+    for i in range(num_clusters):
+        distances = np.linalg.norm(vectors - kmeans.cluster_centers_[i], axis=1)
+        closest_indices.append(np.argmin(distances))
+    return sorted(closest_indices)
+
+
+def best_of(function, repeats: int) -> float:
+    """
+    Returns the fastest wall time of a few runs, in milliseconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000], help="chunks per history")
+    parser.add_argument("--dim", type=int, default=1536, help="embedding dimension")
+    parser.add_argument("--chunk-tokens", type=int, default=250, help="estimated tokens per chunk")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per measurement")
+    args = parser.parse_args()
+
+    print(f"{'chunks':>8}{'k':>5}{'previous ms':>14}{'vectorized ms':>16}{'speedup':>10}")
+    for size in args.sizes:
+        vectors, _ = make_blobs(n_samples=size, n_features=args.dim, centers=max(2, size // 50), random_state=0)
+        vectors = vectors.astype(np.float32)
+        num_clusters = choose_num_clusters(size, args.chunk_tokens)
+
+        previous = best_of(lambda: previous_selection(vectors, num_clusters), args.repeats)
+        vectorized = best_of(lambda: select_representative_indices(vectors, num_clusters), args.repeats)
+        print(f"{size:>8}{num_clusters:>5}{previous:>14.1f}{vectorized:>16.1f}{previous / vectorized:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,24 @@ Assistant Manager - ast_main
 """
 
 import os
-import importlib
 import asyncio
+from typing import Any, Dict, Optional
+from uuid import UUID
 
 from langchain.agents import AgentExecutor, create_openai_tools_agent
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
 # from tools_lib import tools_list
-from source.utils import model, get_memory, fetch_prompt
+from source.utils import get_model, get_memory, fetch_prompt
+from source.cache import LRUCache
+from source.search_tools import SearchTool
+from tool_registry import get_tools
+from single_flight import agent_build_flights, invoke_flights
+from metrics import observe
+from semantic_cache import get_semantic_cache, invalidate_semantic_cache, aembed_query
+from application.settings_manager import on_settings_change, settings_hash
 from logger import logging
 
 from dotenv import load_dotenv
@@ -18,18 +28,19 @@ from dotenv import load_dotenv
 # load_dotenv("/home/bhat/ALQ/ALQ-Projects/mowasalat_bot/.env")
 load_dotenv()
 
-from langchain_core.callbacks import StreamingStdOutCallbackHandler
 
 class AgentManager:
-    def __init__(self, settings: dict):
+    def __init__(self, settings: dict, app_id: str = None):
         """
         Initializes the AgentManager with the given settings.
 
         Args:
             settings (dict): Dictionary containing settings for the agent.
+            app_id (str, optional): The name of the application, defaults to its tool_id.
         """
 
         self.settings= settings
+        self.app_id = app_id or settings["parent_settings"]["tool_id"]
 
     def initialize_agent(self) -> RunnableWithMessageHistory:
         """
@@ -43,12 +54,10 @@ class AgentManager:
         prompt_id= self.settings["parent_settings"]["agent_id"]
         prompt= fetch_prompt(prompt_id)
 
-        tool_id = self.settings["parent_settings"]["tool_id"]
-        tools_name = f'tools_list_{tool_id}'
-        tools_module = importlib.import_module("tools_lib")
-        tools_list = getattr(tools_module, tools_name)
-        
-        agent= create_openai_tools_agent(model, tools_list, prompt)
+        # Tools declared in the settings, built once per settings version
+        tools_list = get_tools(self.app_id, self.settings)
+
+        agent= create_openai_tools_agent(get_model(), tools_list, prompt)
 
 
 
@@ -59,12 +68,11 @@ class AgentManager:
             verbose=False,
             return_intermediate_steps=True,
             early_stopping_method="generate",
-            callbacks=[StreamingStdOutCallbackHandler()]
         )
 
         agent_with_history= RunnableWithMessageHistory(
             agent_executer,
-            lambda session_id: get_memory(session_id),
+            lambda session_id: get_memory(session_id, self.settings["parent_settings"].get("history")),
             input_messages_key="input",
             history_messages_key="chat_history",
 
@@ -72,6 +80,107 @@ class AgentManager:
 
         return agent_with_history
 
+
+# Process-wide cache of built agents keyed by (app_id, agent_id, tool_id, settings hash)
+agent_cache = LRUCache(maxsize=int(os.environ.get("AGENT_CACHE_SIZE", 32)))
+
+
+def get_agent(app_id: str, settings: dict) -> RunnableWithMessageHistory:
+    """
+    Returns the agent for an application, building it only on a cache miss.
+
+    Args:
+        app_id (str): The name of the application.
+        settings (dict): Settings required for agent initialization.
+
+    Returns:
+        RunnableWithMessageHistory: An agent runnable with message history.
+    """
+    key = agent_cache_key(app_id, settings)
+    agent = agent_cache.get(key)
+    if agent is None:
+        logging.info("Building agent for app_id: %s", app_id)
+        with observe("agent_build", app_id):
+            agent = AgentManager(settings=settings, app_id=app_id).initialize_agent()
+        agent_cache.set(key, agent)
+    return agent
+
+
+async def aget_agent(app_id: str, settings: dict) -> RunnableWithMessageHistory:
+    """
+    Async variant of get_agent, building the agent on the loop's default executor on a cache miss.
+
+    Concurrent misses for the same agent share one build.
+
+    Args:
+        app_id (str): The name of the application.
+        settings (dict): Settings required for agent initialization.
+
+    Returns:
+        RunnableWithMessageHistory: An agent runnable with message history.
+    """
+    key = agent_cache_key(app_id, settings)
+    agent = agent_cache.get(key)
+    if agent is None:
+        # to_thread keeps the app_id of the request for the build metrics
+        agent = await agent_build_flights.ado(key, lambda: asyncio.to_thread(get_agent, app_id, settings))
+    return agent
+
+
+def agent_cache_key(app_id: str, settings: dict) -> tuple:
+    """
+    Returns the key of the cached agent of an application for a version of its settings.
+    """
+    parent_settings = settings["parent_settings"]
+    return (app_id, parent_settings["agent_id"], parent_settings["tool_id"], settings_hash(settings))
+
+
+def invalidate_agent_cache(app_id: Optional[str]) -> None:
+    """
+    Drops every cached agent built for an application.
+
+    Args:
+        app_id (str, optional): The name of the application, None for every application.
+    """
+    removed = agent_cache.pop_where(lambda key: app_id is None or key[0] == app_id)
+    logging.info("Invalidated %s cached agent(s) for app_id: %s", removed, app_id)
+
+
+on_settings_change(invalidate_agent_cache)
+on_settings_change(invalidate_semantic_cache)
+
+
+async def lookup_semantic_cache(in_params: dict, settings: dict):
+    """
+    Looks the query up in the semantic cache of the application, when it has opted in.
+
+    On a hit the question and the cached answer are appended to the session
+    history, as if the agent had answered, so later turns stay consistent.
+
+    Args:
+        in_params (dict): Input parameters for the agent execution.
+        settings (dict): Settings of the application.
+
+    Returns:
+        tuple: The cache (None when disabled), the query embedding and the cached answer (None on a miss).
+    """
+    cache = get_semantic_cache(in_params["app_name"], settings)
+    if cache is None:
+        return None, None, None
+    try:
+        embedding = await aembed_query(in_params["query"])
+    except Exception as e:
+        logging.warning("Semantic cache lookup failed, running the agent: %s", e)
+        return None, None, None
+
+    answer = cache.lookup(embedding)
+    if answer is not None:
+        logging.info("Semantic cache hit for app_id: %s", in_params["app_name"])
+        history = get_memory(in_params["session_id"], settings["parent_settings"].get("history"))
+        await history.aadd_messages([HumanMessage(content=in_params["query"]), AIMessage(content=answer)])
+    return cache, embedding, answer
+
+
 async def execute_agent(in_params: dict, settings: dict):
     """
     Executes the agent using the provided input parameters and settings.
@@ -85,11 +194,14 @@ async def execute_agent(in_params: dict, settings: dict):
     """
     session_id = in_params["session_id"]
 
-    # Initialize Agent manager with settings
-    agent_manager = AgentManager(settings=settings)
     try:
-        # Initialize and configure the agent
-        agent = agent_manager.initialize_agent()
+        cache, embedding, answer = await lookup_semantic_cache(in_params, settings)
+        if answer is not None:
+            yield f"{answer}\n\n"
+            return
+
+        # Fetch the cached agent or build it on first use
+        agent = await aget_agent(in_params["app_name"], settings)
         async def agent_stream_async():
             # Use the agent's async stream method if it exists
             async for chunk in agent.astream(
@@ -104,17 +216,117 @@ async def execute_agent(in_params: dict, settings: dict):
             ):
                 yield chunk
 
+        outputs = []
         async for chunk in agent_stream_async():
             content = chunk.get('output', {})
             if content:
                 # Log the chunk being sent
+                outputs.append(content)
                 yield f"{content}\n\n"
+
+        if cache is not None and outputs:
+            cache.store(embedding, "\n\n".join(outputs))
     except Exception as e:
         # Return an error message in case of exception
         result = "Internal Error, If the issue persists please call admin"
         yield result
 
 
+class AgentEventStream(AsyncCallbackHandler):
+    """
+    Turns the callbacks of an agent run into typed frames on a queue.
+
+    Tokens are only forwarded while no tool is running, so tokens of LLM calls
+    made inside tools are dropped and only the tool result is reported.
+
+    Attributes:
+        frames (asyncio.Queue): Frames of type "token", "tool_start" and "tool_end".
+    """
+    def __init__(self):
+        self.frames = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._tools = {}
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        if token and not self._tools:
+            self._put({"type": "token", "content": token})
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                            inputs: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or kwargs.get("name")
+        self._tools[run_id] = name
+        self._put({"type": "tool_start", "tool": name, "input": inputs if inputs is not None else input_str})
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._put({"type": "tool_end", "tool": self._tools.pop(run_id, None), "output": str(output)})
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._put({"type": "tool_end", "tool": self._tools.pop(run_id, None), "output": f"Error: {error}"})
+
+    def close(self) -> None:
+        """
+        Marks the end of the run, once the frames already queued are consumed.
+        """
+        self._put(None)
+
+    def _put(self, frame: Optional[dict]) -> None:
+        # Sync tools may report from a worker thread
+        self._loop.call_soon_threadsafe(self.frames.put_nowait, frame)
+
+
+async def execute_agent_events(in_params: dict, settings: dict):
+    """
+    Executes the agent and streams typed frames as the run progresses.
+
+    The agent runs with ainvoke and its callbacks feed the frames, so streaming
+    costs no more than a plain invocation. LLM tokens of the agent are forwarded
+    as they are generated, tool calls are reported when they start and end, and
+    the answer is sent last. Tokens of LLM calls made inside tools are not
+    forwarded, only the tool result is.
+
+    Args:
+        in_params (dict): Input parameters for the agent execution.
+        settings (dict): Settings required for agent initialization and execution.
+
+    Yields:
+        dict: Frames of type "token", "tool_start", "tool_end", "final" or "error".
+    """
+    run = None
+    try:
+        cache, embedding, answer = await lookup_semantic_cache(in_params, settings)
+        if answer is not None:
+            yield {"type": "final", "content": answer}
+            return
+
+        # Fetch the cached agent or build it on first use
+        agent = await aget_agent(in_params["app_name"], settings)
+
+        events = AgentEventStream()
+        run = asyncio.ensure_future(agent.ainvoke(
+            {"input": in_params["query"]},
+            {"configurable": {"session_id": in_params["session_id"]}, "callbacks": [events]},
+        ))
+        run.add_done_callback(lambda _: events.close())
+
+        while True:
+            frame = await events.frames.get()
+            if frame is None:
+                break
+            yield frame
+
+        output = (await run)["output"]
+        yield {"type": "final", "content": output}
+        if cache is not None and output:
+            cache.store(embedding, output)
+    except Exception as e:
+        logging.error("Error during agent execution: %s", e)
+        yield {"type": "error", "content": "Internal Error, If the issue persists please call admin"}
+    finally:
+        # The consumer went away, e.g. a cancelled request, so stop the run too
+        if run is not None and not run.done():
+            run.cancel()
+
+
 def execute_agent_0(in_params: dict, settings: dict):
     """
     Executes the agent using the provided input parameters and settings.
@@ -126,16 +338,14 @@ def execute_agent_0(in_params: dict, settings: dict):
     Returns:
         str: Result of the agent execution.
     """
-    print("Entered execute agent")
+    logging.debug("Entered execute agent")
     session_id = in_params["session_id"]
-    print(f"SESSION ID: {session_id}")
+    logging.debug(f"SESSION ID: {session_id}")
 
-    # Initialize Agent manager with settings
-    agent_manager= AgentManager(settings=settings)
     try:
-        # initialize and configure the agent
-        agent= agent_manager.initialize_agent()
-        print("AGENT INITIALIZED")
+        # Fetch the cached agent or build it on first use
+        agent= get_agent(in_params["app_name"], settings)
+        logging.debug("AGENT INITIALIZED")
 
         # invoke the agent with input params
         result= agent.invoke({
@@ -145,11 +355,75 @@ def execute_agent_0(in_params: dict, settings: dict):
                 "session_id": session_id
             }
         })
-        print("INVOKED AGENT")
+        logging.debug("INVOKED AGENT")
         result = result["output"]
     except Exception as e:
-        print(f"Error during agent execution: {e}")
+        logging.error(f"Error during agent execution: {e}")
         # Return an error message in case of exception
         result = "Internal Error, If the issue persists please call admin"
     
-    return result
\ No newline at end of file
+    return result
+
+async def execute_agent_async(in_params: dict, settings: dict) -> str:
+    """
+    Executes the agent without blocking the event loop.
+
+    The agent is run with ainvoke, so LLM calls and async tools are awaited on the
+    event loop while sync-only tools and history I/O run on the loop's default executor.
+
+    Applications with parent_settings.coalesce_invoke enabled share one agent run
+    between concurrent identical queries; the run uses the history of the first
+    caller and the other callers get the answer appended to their own history.
+
+    Args:
+        in_params (dict): Input parameters for the agent execution.
+        settings (dict): Settings required for agent initialization and execution.
+
+    Returns:
+        str: Result of the agent execution.
+    """
+    session_id = in_params["session_id"]
+
+    try:
+        cache, embedding, answer = await lookup_semantic_cache(in_params, settings)
+        if answer is not None:
+            return answer
+
+        async def run_agent() -> str:
+            # Fetch the cached agent or build it on first use
+            agent = await aget_agent(in_params["app_name"], settings)
+
+            # invoke the agent with input params
+            result = await agent.ainvoke({
+                "input": in_params["query"]
+            }, {
+                "configurable": {
+                    "session_id": session_id
+                }
+            })
+            return result["output"]
+
+        if settings["parent_settings"].get("coalesce_invoke"):
+            ran = False
+
+            async def run_leader() -> str:
+                nonlocal ran
+                ran = True
+                return await run_agent()
+
+            key = (in_params["app_name"], SearchTool.normalize_query(in_params["query"]))
+            result = await invoke_flights.ado(key, run_leader)
+            if not ran:
+                history = get_memory(session_id, settings["parent_settings"].get("history"))
+                await history.aadd_messages([HumanMessage(content=in_params["query"]), AIMessage(content=result)])
+        else:
+            result = await run_agent()
+
+        if cache is not None:
+            cache.store(embedding, result)
+    except Exception as e:
+        logging.error("Error during agent execution: %s", e)
+        # Return an error message in case of exception
+        result = "Internal Error, If the issue persists please call admin"
+
+    return result
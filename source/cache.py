@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A small thread-safe least-recently-used cache.
+
+    Attributes:
+        maxsize (int): Maximum number of entries kept before the oldest is evicted.
+        hits (int): Number of successful lookups.
+        misses (int): Number of failed lookups.
+    """
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for a key and marks it as recently used.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is not cached.
+
+        Returns:
+            object: The cached value or the default.
+        """
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Stores a value, evicting the least recently used entry when full.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Removes a key from the cache.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is not cached.
+
+        Returns:
+            object: The removed value or the default.
+        """
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def pop_where(self, predicate) -> int:
+        """
+        Removes every entry whose key matches the predicate.
+
+        Args:
+            predicate (callable): Function receiving a key and returning True to remove it.
+
+        Returns:
+            int: Number of removed entries.
+        """
+        with self._lock:
+            keys = [key for key in self._data if predicate(key)]
+            for key in keys:
+                del self._data[key]
+            return len(keys)
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns the cache counters.
+
+        Returns:
+            dict: Size, hits and misses of the cache.
+        """
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses}
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """
+    An LRU cache whose entries expire after a time to live.
+
+    Attributes:
+        ttl (float): Default time to live of an entry in seconds.
+    """
+    def __init__(self, maxsize: int = 128, ttl: float = 300):
+        super().__init__(maxsize=maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for a key unless it has expired.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is not cached or expired.
+
+        Returns:
+            object: The cached value or the default.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Stores a value with a time to live.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+            ttl (float, optional): Time to live of this entry, defaults to the cache TTL.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        super().set(key, (time.monotonic() + ttl, value))
+
+    def pop(self, key, default=None):
+        """
+        Removes a key from the cache.
+
+        Args:
+            key: The cache key.
+            default: Value returned when the key is not cached.
+
+        Returns:
+            object: The removed value or the default.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            return default if entry is None else entry[1]
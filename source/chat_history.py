@@ -0,0 +1,346 @@
+import contextvars
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, List, Optional, Sequence
+
+import redis
+import redis.asyncio
+import tiktoken
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import BaseMessage, SystemMessage, message_to_dict, messages_from_dict
+
+from logger import logging
+from metrics import observe
+
+# Seconds a worker may hold the fold lock of a session, bounds the summarizer call
+FOLD_LOCK_TTL = float(os.environ.get("HISTORY_FOLD_LOCK_TTL", 120))
+
+# Connection pools shared by every chat history of the process
+_redis_client = None
+_async_redis_client = None
+
+
+def get_redis_client() -> redis.Redis:
+    """
+    Returns the process-wide Redis client backed by a shared connection pool.
+
+    Returns:
+        redis.Redis: The pooled Redis client.
+    """
+    global _redis_client
+    if _redis_client is None:
+        pool = redis.ConnectionPool.from_url(
+            os.environ.get("REDIS_URL"),
+            max_connections=int(os.environ.get("REDIS_MAX_CONNECTIONS", 64)),
+        )
+        _redis_client = redis.Redis(connection_pool=pool)
+    return _redis_client
+
+
+def get_async_redis_client() -> redis.asyncio.Redis:
+    """
+    Returns the process-wide async Redis client backed by a shared connection pool.
+
+    Must be called from the event loop that will use the client.
+
+    Returns:
+        redis.asyncio.Redis: The pooled async Redis client.
+    """
+    global _async_redis_client
+    if _async_redis_client is None:
+        pool = redis.asyncio.ConnectionPool.from_url(
+            os.environ.get("REDIS_URL"),
+            max_connections=int(os.environ.get("REDIS_MAX_CONNECTIONS", 64)),
+        )
+        _async_redis_client = redis.asyncio.Redis(connection_pool=pool)
+    return _async_redis_client
+
+
+class PooledRedisChatMessageHistory(BaseChatMessageHistory):
+    """
+    Chat message history stored in Redis over the shared connection pools.
+
+    Uses the same key layout as RedisChatMessageHistory, so existing sessions
+    keep working. Reading the history is one LRANGE and saving a turn is a single
+    pipelined LPUSH plus EXPIRE, whatever the number of messages.
+
+    When max_messages is set the history is windowed: only the newest
+    max_messages are read, trimmed further to token_budget, and older messages
+    are folded by the summarizer into a rolling summary stored next to the
+    session and returned as a leading system message.
+
+    Attributes:
+        session_id (str): The session whose messages are stored.
+        ttl (int): Seconds after the last write before the session expires.
+        key_prefix (str): Prefix of the Redis list key.
+        max_messages (int): Number of newest messages read, None reads the whole list.
+        token_budget (int): Maximum number of tokens of the returned history.
+        summarizer (callable): Function receiving the messages to fold and the previous
+            summary and returning the new summary.
+    """
+    def __init__(self, session_id: str, ttl: Optional[int] = None, key_prefix: str = "message_store:",
+                 max_messages: Optional[int] = None, token_budget: Optional[int] = None,
+                 summarizer: Optional[Callable[[List[BaseMessage], str], str]] = None):
+        self.session_id = session_id
+        self.ttl = ttl
+        self.key_prefix = key_prefix
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.summarizer = summarizer
+
+    @property
+    def key(self) -> str:
+        """
+        Returns the Redis list key of the session.
+        """
+        return self.key_prefix + self.session_id
+
+    @property
+    def summary_key(self) -> str:
+        """
+        Returns the Redis key of the rolling summary of the session.
+        """
+        return "message_summary:" + self.session_id
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """
+        Retrieves the messages of the session, oldest first.
+        """
+        with observe("history_load"):
+            if self.max_messages is None:
+                items = get_redis_client().lrange(self.key, 0, -1)
+                return self._window(items, None)
+
+            pipe = get_redis_client().pipeline(transaction=False)
+            pipe.lrange(self.key, 0, self.max_messages - 1)
+            pipe.get(self.summary_key)
+            items, summary = pipe.execute()
+            return self._window(items, summary)
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """
+        Async variant of messages.
+        """
+        with observe("history_load"):
+            if self.max_messages is None:
+                items = await get_async_redis_client().lrange(self.key, 0, -1)
+                return self._window(items, None)
+
+            pipe = get_async_redis_client().pipeline(transaction=False)
+            pipe.lrange(self.key, 0, self.max_messages - 1)
+            pipe.get(self.summary_key)
+            items, summary = await pipe.execute()
+            return self._window(items, summary)
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Appends messages and refreshes the TTL in a single round trip.
+
+        Args:
+            messages (Sequence[BaseMessage]): The messages to append.
+        """
+        if not messages:
+            return
+        with observe("history_save"):
+            pipe = get_redis_client().pipeline(transaction=False)
+            self._queue_add(pipe, messages)
+            length = pipe.execute()[0]
+        self._maybe_fold(length)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Async variant of add_messages.
+
+        RunnableWithMessageHistory saves a turn from a sync end listener, which
+        the async callback manager runs on the loop's default executor, so agent
+        turns are saved with add_messages even under ainvoke. This variant is
+        for turns saved outside the runnable, e.g. semantic cache hits.
+
+        Args:
+            messages (Sequence[BaseMessage]): The messages to append.
+        """
+        if not messages:
+            return
+        with observe("history_save"):
+            pipe = get_async_redis_client().pipeline(transaction=False)
+            self._queue_add(pipe, messages)
+            length = (await pipe.execute())[0]
+        self._maybe_fold(length)
+
+    def clear(self) -> None:
+        """
+        Deletes the session and its summary from Redis.
+        """
+        get_redis_client().delete(self.key, self.summary_key)
+
+    async def aclear(self) -> None:
+        """
+        Async variant of clear.
+        """
+        await get_async_redis_client().delete(self.key, self.summary_key)
+
+    def _queue_add(self, pipe, messages: Sequence[BaseMessage]) -> None:
+        """
+        Queues the writes of a batch of messages on a pipeline.
+
+        The first result of the pipeline is the new length of the list.
+        """
+        pipe.lpush(self.key, *[json.dumps(message_to_dict(message)) for message in messages])
+        if self.ttl:
+            pipe.expire(self.key, self.ttl)
+            if self.max_messages is not None:
+                pipe.expire(self.summary_key, self.ttl)
+
+    def _maybe_fold(self, length: int) -> None:
+        """
+        Folds the messages beyond the window into the summary once enough have piled up.
+
+        The fold calls the LLM, so it runs on a background thread and never delays the turn.
+        The thread runs in a copy of the current context, so its metrics keep the application label.
+        """
+        if self.max_messages is None or self.summarizer is None:
+            return
+        if length < self.max_messages + max(self.max_messages // 2, 2):
+            return
+        with _folding_lock:
+            if self.key in _folding:
+                return
+            _folding.add(self.key)
+        _fold_executor.submit(contextvars.copy_context().run, self._fold)
+
+    def _fold(self) -> None:
+        """
+        Summarizes the messages beyond the window and removes them from the list.
+
+        The fold holds a Redis lock on the session, so workers never fold the same
+        tail twice, and the trim only commits while the lock is still held. New
+        messages are pushed at the head, so they do not move the folded tail.
+        """
+        client = get_redis_client()
+        lock_key = "fold_lock:" + self.session_id
+        token = uuid.uuid4().hex
+        locked = False
+        try:
+            locked = client.set(lock_key, token, nx=True, px=int(FOLD_LOCK_TTL * 1000))
+            if not locked:
+                return
+
+            checkpoint_key = "summary_checkpoint:" + self.session_id
+            pipe = client.pipeline(transaction=False)
+            pipe.lrange(self.key, self.max_messages, -1)
+            pipe.get(self.summary_key)
+            pipe.exists(checkpoint_key)
+            items, summary, has_checkpoint = pipe.execute()
+            if not items:
+                return
+
+            new_summary = self.summarizer(self._decode(items), self._decode_summary(summary))
+
+            # Newer messages are pushed at the head, so trimming by count only drops the folded tail
+            with client.pipeline(transaction=True) as pipe:
+                pipe.watch(lock_key)
+                if self._decode_summary(pipe.get(lock_key)) != token:
+                    logging.warning("Fold lock of session %s expired, discarding the fold", self.session_id)
+                    return
+                pipe.multi()
+                pipe.set(self.summary_key, new_summary, ex=self.ttl)
+                pipe.ltrim(self.key, 0, -(len(items) + 1))
+                if has_checkpoint:
+                    # Keep the incremental summarization checkpoint pointing at the same message
+                    pipe.hincrby(checkpoint_key, "index", -len(items))
+                pipe.execute()
+        except Exception as e:
+            logging.warning("Folding history of session %s failed: %s", self.session_id, e)
+        finally:
+            if locked:
+                self._release_fold_lock(client, lock_key, token)
+            with _folding_lock:
+                _folding.discard(self.key)
+
+    def _release_fold_lock(self, client, lock_key: str, token: str) -> None:
+        """
+        Deletes the fold lock of the session if this fold still holds it.
+        """
+        try:
+            with client.pipeline(transaction=True) as pipe:
+                pipe.watch(lock_key)
+                if self._decode_summary(pipe.get(lock_key)) == token:
+                    pipe.multi()
+                    pipe.delete(lock_key)
+                    pipe.execute()
+        except redis.WatchError:
+            pass
+
+    def _window(self, items, summary) -> List[BaseMessage]:
+        """
+        Decodes the read items and trims them to the token budget, newest kept first.
+        """
+        messages = self._decode(items)
+        summary = self._decode_summary(summary)
+        summary_messages = []
+        if summary:
+            summary_messages = [SystemMessage(content=f"Summary of the earlier conversation: {summary}")]
+
+        if self.token_budget is None:
+            return summary_messages + messages
+
+        budget = self.token_budget - sum(count_tokens(m.content) for m in summary_messages)
+        kept = 0
+        for message in reversed(messages):
+            budget -= count_tokens(message.content)
+            if budget < 0:
+                break
+            kept += 1
+        return summary_messages + messages[len(messages) - kept:]
+
+    @staticmethod
+    def _decode(items) -> List[BaseMessage]:
+        """
+        Decodes LRANGE items, which are stored newest first.
+        """
+        return messages_from_dict([json.loads(item) for item in items[::-1]])
+
+    @staticmethod
+    def _decode_summary(summary) -> str:
+        if isinstance(summary, bytes):
+            return summary.decode("utf-8")
+        return summary or ""
+
+
+# Background folds of histories into their rolling summaries, one per session at a time
+_fold_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-fold")
+_folding = set()
+_folding_lock = threading.Lock()
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # The encoding is downloaded on first use, fall back to an estimate when offline
+        logging.warning("Could not load the tiktoken encoding, estimating token counts: %s", e)
+        return None
+
+
+def count_tokens(content) -> int:
+    """
+    Counts the tokens of a message content.
+
+    Args:
+        content (str or list): The content of a message.
+
+    Returns:
+        int: Number of tokens.
+    """
+    if not isinstance(content, str):
+        content = json.dumps(content)
+    encoding = _encoding()
+    if encoding is None:
+        return len(content) // 4 + 1
+    return len(encoding.encode(content, disallowed_special=()))
@@ -1,4 +1,4 @@
-from utils import model, fetch_prompt
+from utils import get_model, fetch_prompt
 
 from logger import logging
 
@@ -22,11 +22,11 @@ class ChainHandler:
          # Fetch prompt based on the provided prompt ID
         logging.info("Fetching prompt")
         prompt = fetch_prompt(prompt_id)
-        logging.info("Prompt fetched successfully.", prompt_id)
+        logging.info("Prompt fetched successfully: %s", prompt_id)
 
         # Concatenate the fetched prompt with the model
         logging.info("Creating chain by concatenating prompt with model.")
-        chain = prompt | model
+        chain = prompt | get_model()
         logging.info("Chain created successfully.")
         
         return chain
@@ -1,9 +1,24 @@
 import os
+from functools import lru_cache
 from langchain_elasticsearch import ElasticsearchStore
 from elasticsearch import Elasticsearch
 from langchain_openai import OpenAIEmbeddings
 
-embeddings = OpenAIEmbeddings(api_key=os.environ.get("OPENAI_API_KEY"))
+from embedding_cache import CachedEmbeddings
+from local_vector_store import LOCAL_VECTOR_DIR, LocalVectorStore
+
+
+@lru_cache(maxsize=None)
+def get_embeddings() -> CachedEmbeddings:
+    """
+    Return the process-wide embeddings, built on first use.
+
+    Embeddings are served from the shared embedding cache and only computed on a miss.
+
+    Returns:
+        CachedEmbeddings: The cached OpenAI embeddings.
+    """
+    return CachedEmbeddings(OpenAIEmbeddings(api_key=os.environ.get("OPENAI_API_KEY")))
 
 
 def setup_es_client() -> Elasticsearch:
@@ -29,8 +44,15 @@ def setup_es_client() -> Elasticsearch:
     return es_client
 
 
-# Create the Elasticsearch client by calling the setup function
-es_client = setup_es_client()
+@lru_cache(maxsize=None)
+def get_es_client() -> Elasticsearch:
+    """
+    Return the process-wide Elasticsearch client, built on first use.
+
+    Returns:
+        Elasticsearch: An initialized Elasticsearch client.
+    """
+    return setup_es_client()
 
 
 def setup_es_store(index_name: str, es_client: Elasticsearch):
@@ -47,12 +69,55 @@ def setup_es_store(index_name: str, es_client: Elasticsearch):
 
        """
     es_vector_store = ElasticsearchStore(
-        embedding=embeddings,
+        embedding=get_embeddings(),
         index_name=index_name,
         es_connection=es_client
     )
     return es_vector_store
 
-# Setup Elasticsearch store
-es_store = setup_es_store("azal_activities", es_client)
+@lru_cache(maxsize=None)
+def get_es_store(index_name: str = "azal_activities") -> ElasticsearchStore:
+    """
+    Return the process-wide ElasticsearchStore of an index, built on first use.
+
+    Args:
+        index_name (str): The name of the Elasticsearch index.
+
+    Returns:
+        ElasticsearchStore: The store of the index.
+    """
+    return setup_es_store(index_name, get_es_client())
+
+
+@lru_cache(maxsize=None)
+def get_vector_store(index_name: str = "azal_activities", backend: str = "elasticsearch"):
+    """
+    Return the process-wide vector store of an index on the selected backend.
+
+    Args:
+        index_name (str): The name of the index.
+        backend (str): "elasticsearch", or "local" for a LocalVectorStore under LOCAL_VECTOR_DIR.
+
+    Returns:
+        VectorStore: The store of the index.
+    """
+    if backend == "local":
+        return LocalVectorStore(os.path.join(LOCAL_VECTOR_DIR, index_name), get_embeddings())
+    if backend == "elasticsearch":
+        return get_es_store(index_name)
+    raise ValueError(f"Unknown vector store backend: {backend}")
+
+
+# Module attributes kept for existing callers, each built on first access
+_lazy_attributes = {
+    "embeddings": get_embeddings,
+    "es_client": get_es_client,
+    "es_store": get_es_store,
+}
+
+
+def __getattr__(name: str):
+    if name in _lazy_attributes:
+        return _lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
@@ -0,0 +1,297 @@
+import atexit
+import fcntl
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from logger import logging
+
+
+class EmbeddingStore:
+    """
+    Size-bounded store of embeddings in a memory-mapped float32 matrix.
+
+    Rows of the matrix are slots; a hash index maps content keys to slots and
+    remembers their use order, so the least recently used slot is reused once
+    the store is full. The index is written next to the matrix so the store
+    survives restarts. Each row is tagged with a digest of its key, so a row
+    reused after the last index write is not served for its former key when
+    the process died before writing the index again. A store file is owned by one process: when another
+    process already holds it, the store falls back to an in-memory matrix.
+
+    Attributes:
+        path (str): Path prefix of the matrix (.npy), row tags (.keys.npy) and index (.index.json) files.
+        capacity (int): Maximum number of embeddings kept.
+        dim (int): Dimension of the embeddings, known after the first write.
+    """
+    def __init__(self, path: str, capacity: int = 20000, flush_every: int = 256):
+        self.path = path
+        self.capacity = capacity
+        self.flush_every = flush_every
+        self.dim = None
+        self._vectors = None
+        self._tags = None
+        self._slots = OrderedDict()
+        self._free = []
+        self._dirty = 0
+        self._lock = threading.Lock()
+        self._persistent = self._acquire_file_lock()
+        if self._persistent:
+            self._load()
+            atexit.register(self.flush)
+
+    def get_many(self, keys: List[str]) -> list:
+        """
+        Looks up embeddings by key.
+
+        Args:
+            keys (List[str]): The content keys.
+
+        Returns:
+            list: One float32 vector per key, None for the keys not stored.
+        """
+        with self._lock:
+            found = []
+            for key in keys:
+                slot = self._slots.get(key)
+                if slot is None:
+                    found.append(None)
+                elif self._tags[slot].tobytes() != self._tag(key):
+                    # The row was reused for another key, the index entry is stale
+                    del self._slots[key]
+                    self._free.append(slot)
+                    found.append(None)
+                else:
+                    self._slots.move_to_end(key)
+                    found.append(np.array(self._vectors[slot]))
+            return found
+
+    def put_many(self, keys: List[str], vectors) -> None:
+        """
+        Stores embeddings, evicting the least recently used ones when full.
+
+        Args:
+            keys (List[str]): The content keys.
+            vectors: The embeddings, one per key.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            if self._vectors is None:
+                self._create(vectors.shape[1])
+            for key, vector in zip(keys, vectors):
+                slot = self._slots.get(key)
+                if slot is None:
+                    slot = self._take_slot()
+                # The tag is cleared while the row is rewritten, so a crash in between leaves no valid row
+                self._tags[slot] = 0
+                self._vectors[slot] = vector
+                self._tags[slot] = np.frombuffer(self._tag(key), dtype=np.uint8)
+                self._slots[key] = slot
+                self._slots.move_to_end(key)
+            self._dirty += len(keys)
+            if self._dirty >= self.flush_every:
+                self._flush()
+
+    def flush(self) -> None:
+        """
+        Writes the matrix and the index to disk.
+        """
+        with self._lock:
+            self._flush()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    @staticmethod
+    def _tag(key: str) -> bytes:
+        return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+    def _take_slot(self) -> int:
+        if self._free:
+            return self._free.pop()
+        _, slot = self._slots.popitem(last=False)
+        return slot
+
+    def _create(self, dim: int) -> None:
+        self.dim = dim
+        if self._persistent:
+            self._vectors = np.lib.format.open_memmap(
+                f"{self.path}.npy", mode="w+", dtype=np.float32, shape=(self.capacity, dim)
+            )
+            self._tags = np.lib.format.open_memmap(
+                f"{self.path}.keys.npy", mode="w+", dtype=np.uint8, shape=(self.capacity, 16)
+            )
+        else:
+            self._vectors = np.zeros((self.capacity, dim), dtype=np.float32)
+            self._tags = np.zeros((self.capacity, 16), dtype=np.uint8)
+        self._free = list(range(self.capacity - 1, -1, -1))
+
+    def _load(self) -> None:
+        index_path = f"{self.path}.index.json"
+        paths = (index_path, f"{self.path}.npy", f"{self.path}.keys.npy")
+        if not all(os.path.exists(path) for path in paths):
+            return
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            vectors = np.lib.format.open_memmap(f"{self.path}.npy", mode="r+")
+            tags = np.lib.format.open_memmap(f"{self.path}.keys.npy", mode="r+")
+        except Exception as e:
+            logging.warning("Ignoring unreadable embedding store %s: %s", self.path, e)
+            return
+        if vectors.shape[0] != self.capacity or tags.shape != (self.capacity, 16):
+            logging.warning("Embedding store %s has a different capacity, starting empty", self.path)
+            return
+        self.dim = vectors.shape[1]
+        self._vectors = vectors
+        self._tags = tags
+        # Entries whose row was reused after the index was written are dropped
+        self._slots = OrderedDict(
+            (key, slot) for key, slot in index["slots"] if tags[slot].tobytes() == self._tag(key)
+        )
+        if len(self._slots) < len(index["slots"]):
+            logging.warning("Dropped %s stale entries of embedding store %s",
+                            len(index["slots"]) - len(self._slots), self.path)
+        used = set(self._slots.values())
+        self._free = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+
+    def _flush(self) -> None:
+        if not self._persistent or self._vectors is None:
+            return
+        self._vectors.flush()
+        self._tags.flush()
+        index_path = f"{self.path}.index.json"
+        tmp_path = f"{index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "slots": list(self._slots.items())}, f)
+        os.replace(tmp_path, index_path)
+        self._dirty = 0
+
+    def _acquire_file_lock(self) -> bool:
+        """
+        Takes an exclusive lock on the store files for the lifetime of the process.
+        """
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._lock_file = open(f"{self.path}.lock", "w")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError as e:
+            logging.warning("Embedding store %s is in use, keeping embeddings in memory: %s", self.path, e)
+            return False
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated texts from an EmbeddingStore.
+
+    Texts are keyed by a hash of (model, text). Batch lookups send only the
+    distinct misses to the wrapped embedder, in a single request.
+
+    Attributes:
+        embedder (Embeddings): The wrapped embedder.
+        model (str): Name of the embedding model, part of every key.
+        store (EmbeddingStore): Where embeddings are kept.
+    """
+    def __init__(self, embedder: Embeddings, store: EmbeddingStore = None):
+        self.embedder = embedder
+        self.model = str(getattr(embedder, "model", type(embedder).__name__))
+        self.store = store if store is not None else get_embedding_store(self.model)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, text: str) -> str:
+        """
+        Returns the content key of a text for this model.
+
+        Args:
+            text (str): The text to embed.
+
+        Returns:
+            str: Hex digest of the model name and the text.
+        """
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        if missing:
+            embedded = self.embedder.embed_documents(list(missing))
+            self._store(keys, vectors, missing, embedded)
+        return [vector.tolist() for vector in vectors]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, vectors, missing = self._lookup(texts)
+        if missing:
+            embedded = await self.embedder.aembed_documents(list(missing))
+            self._store(keys, vectors, missing, embedded)
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = self._lookup([text])
+        if missing:
+            self._store(keys, vectors, missing, [self.embedder.embed_query(text)])
+        return vectors[0].tolist()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        keys, vectors, missing = self._lookup([text])
+        if missing:
+            self._store(keys, vectors, missing, [await self.embedder.aembed_query(text)])
+        return vectors[0].tolist()
+
+    def _lookup(self, texts: List[str]):
+        """
+        Returns the keys, the cached vectors and the distinct missing texts with their positions.
+        """
+        keys = [self.key(text) for text in texts]
+        vectors = self.store.get_many(keys)
+        missing = OrderedDict()
+        for position, (text, vector) in enumerate(zip(texts, vectors)):
+            if vector is None:
+                missing.setdefault(text, []).append(position)
+        self.misses += sum(len(positions) for positions in missing.values())
+        self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+        return keys, vectors, missing
+
+    def _store(self, keys, vectors, missing, embedded) -> None:
+        """
+        Stores the embedded misses and fills their positions in the result.
+        """
+        embedded = np.asarray(embedded, dtype=np.float32)
+        miss_keys = [keys[positions[0]] for positions in missing.values()]
+        self.store.put_many(miss_keys, embedded)
+        for positions, vector in zip(missing.values(), embedded):
+            for position in positions:
+                vectors[position] = vector
+
+
+# One store per embedding model, shared by every wrapper in the process
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(model: str) -> EmbeddingStore:
+    """
+    Returns the process-wide store of an embedding model.
+
+    Args:
+        model (str): Name of the embedding model.
+
+    Returns:
+        EmbeddingStore: The store, created on first use.
+    """
+    with _stores_lock:
+        if model not in _stores:
+            cache_dir = os.environ.get("EMBEDDING_CACHE_DIR", os.path.join(os.getcwd(), ".embedding_cache"))
+            name = re.sub(r"[^A-Za-z0-9_.-]", "_", model)
+            _stores[model] = EmbeddingStore(
+                os.path.join(cache_dir, name),
+                capacity=int(os.environ.get("EMBEDDING_CACHE_SIZE", 20000)),
+            )
+        return _stores[model]
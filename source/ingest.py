@@ -0,0 +1,309 @@
+"""
+Ingestion - ingest
+
+Streams documents from a JSONL or CSV file into a vector store index. Records
+are read and chunked lazily, chunks are embedded in large batches with a
+bounded number of requests in flight, and batches are written in order with
+Elasticsearch parallel_bulk or to a LocalVectorStore. After every written
+batch the position of the last ingested record is saved to a checkpoint file,
+so an interrupted run resumes where it stopped.
+
+Usage:
+    python source/ingest.py activities.jsonl --index azal_activities --text-field description
+    python source/ingest.py activities.csv --index azal_activities --backend local --concurrency 8
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from typing import Iterable, Iterator, List, Optional
+
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from logger import logging
+
+
+def read_records(path: str, start: int = 0) -> Iterator[tuple]:
+    """
+    Streams the records of a JSONL or CSV file.
+
+    Args:
+        path (str): The input file, read as CSV when it ends with .csv.
+        start (int): Number of leading records to skip.
+
+    Yields:
+        tuple: The position of the record in the file and the record.
+    """
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for position, record in enumerate(rows):
+            if position >= start:
+                yield position, record
+
+
+def chunk_records(records: Iterable[tuple], text_field: str, id_field: Optional[str] = None,
+                  chunk_size: int = 1000, chunk_overlap: int = 100) -> Iterator[dict]:
+    """
+    Splits records into chunks, keeping the other fields of a record as the metadata of its chunks.
+
+    Args:
+        records (Iterable[tuple]): Positions and records, as yielded by read_records.
+        text_field (str): The field holding the text to embed.
+        id_field (str, optional): The field holding the record id, the position is used otherwise.
+        chunk_size (int): Maximum number of characters of a chunk.
+        chunk_overlap (int): Characters shared by consecutive chunks.
+
+    Yields:
+        dict: The chunk, with its id, text, metadata and the position of its record.
+    """
+    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for position, record in records:
+        text = record.get(text_field) or ""
+        record_id = record.get(id_field) if id_field else None
+        record_id = str(record_id if record_id is not None else position)
+        metadata = {key: value for key, value in record.items() if key != text_field}
+        for number, chunk in enumerate(splitter.split_text(text)):
+            yield {"id": f"{record_id}-{number}", "text": chunk, "metadata": metadata, "position": position}
+
+
+def batch_chunks(chunks: Iterable[dict], batch_size: int) -> Iterator[List[dict]]:
+    """
+    Groups chunks into batches of about batch_size, cut on record boundaries.
+
+    A batch holds every chunk of its records, so a written batch always ends on
+    a fully ingested record and the checkpoint can point right after it.
+
+    Args:
+        chunks (Iterable[dict]): The chunks, grouped by record.
+        batch_size (int): Number of chunks after which a batch is closed.
+
+    Yields:
+        List[dict]: The batches.
+    """
+    batch = []
+    for chunk in chunks:
+        if len(batch) >= batch_size and chunk["position"] != batch[-1]["position"]:
+            yield batch
+            batch = []
+        batch.append(chunk)
+    if batch:
+        yield batch
+
+
+class ElasticsearchWriter:
+    def __init__(self, es_client, index_name: str, thread_count: int = 4, chunk_size: int = 500):
+        """
+        Writes embedded chunks to an Elasticsearch index laid out like ElasticsearchStore.
+
+        Args:
+            es_client (Elasticsearch): The Elasticsearch client.
+            index_name (str): The index to write to, created on the first write.
+            thread_count (int): Threads used by parallel_bulk.
+            chunk_size (int): Documents per bulk request.
+        """
+        self.es_client = es_client
+        self.index_name = index_name
+        self.thread_count = thread_count
+        self.chunk_size = chunk_size
+        self._index_ready = False
+
+    def write(self, chunks: List[dict], vectors: List[List[float]]) -> None:
+        from elasticsearch.helpers import parallel_bulk
+
+        if not self._index_ready:
+            self._create_index(len(vectors[0]))
+        actions = (
+            {
+                "_op_type": "index",
+                "_index": self.index_name,
+                "_id": chunk["id"],
+                "_source": {"text": chunk["text"], "vector": vector, "metadata": chunk["metadata"]},
+            }
+            for chunk, vector in zip(chunks, vectors)
+        )
+        for ok, item in parallel_bulk(self.es_client, actions, thread_count=self.thread_count,
+                                      chunk_size=self.chunk_size, raise_on_error=False):
+            if not ok:
+                raise RuntimeError(f"Bulk indexing into {self.index_name} failed: {item}")
+
+    def _create_index(self, dims: int) -> None:
+        """
+        Creates the index with the mapping ElasticsearchStore uses for cosine kNN search.
+        """
+        if not self.es_client.indices.exists(index=self.index_name):
+            self.es_client.indices.create(index=self.index_name, mappings={
+                "properties": {
+                    "text": {"type": "text"},
+                    "vector": {"type": "dense_vector", "dims": dims, "index": True, "similarity": "cosine"},
+                    "metadata": {"type": "object"},
+                }
+            })
+        self._index_ready = True
+
+
+class LocalWriter:
+    def __init__(self, store):
+        """
+        Writes embedded chunks to a LocalVectorStore.
+
+        Chunks whose id is already stored are skipped, so the batch written
+        before a crash and not yet checkpointed is not stored twice on resume.
+
+        Args:
+            store (LocalVectorStore): The local store of the index.
+        """
+        self.store = store
+        self._ids = store.get_ids()
+
+    def write(self, chunks: List[dict], vectors: List[List[float]]) -> None:
+        new = [(chunk, vector) for chunk, vector in zip(chunks, vectors) if chunk["id"] not in self._ids]
+        if not new:
+            return
+        self.store.add_embeddings(
+            [chunk["text"] for chunk, _ in new],
+            [vector for _, vector in new],
+            [chunk["metadata"] for chunk, _ in new],
+            [chunk["id"] for chunk, _ in new],
+        )
+        self._ids.update(chunk["id"] for chunk, _ in new)
+
+
+async def ingest(path: str, writer, embeddings, text_field: str, id_field: Optional[str] = None,
+                 checkpoint_path: Optional[str] = None, chunk_size: int = 1000, chunk_overlap: int = 100,
+                 batch_size: int = 256, concurrency: int = 4) -> dict:
+    """
+    Ingests a JSONL or CSV file into a vector store index.
+
+    Up to concurrency batches are embedded at the same time while the oldest
+    batch is written, and batches are written in input order so the checkpoint
+    only ever moves forward.
+
+    Args:
+        path (str): The input file.
+        writer: ElasticsearchWriter or LocalWriter of the target index.
+        embeddings (Embeddings): Embeds the chunks.
+        text_field (str): The field holding the text to embed.
+        id_field (str, optional): The field holding the record id.
+        checkpoint_path (str, optional): The checkpoint file, defaults to <path>.checkpoint.json.
+        chunk_size (int): Maximum number of characters of a chunk.
+        chunk_overlap (int): Characters shared by consecutive chunks.
+        batch_size (int): Chunks embedded per request.
+        concurrency (int): Maximum number of embedding requests in flight.
+
+    Returns:
+        dict: Counts of ingested records and chunks, elapsed seconds and throughput.
+    """
+    checkpoint_path = checkpoint_path or f"{path}.checkpoint.json"
+    start = load_checkpoint(checkpoint_path)
+    if start:
+        logging.info("Resuming ingestion of %s after %s records", path, start)
+
+    loop = asyncio.get_running_loop()
+    batches = batch_chunks(
+        chunk_records(read_records(path, start), text_field, id_field, chunk_size, chunk_overlap),
+        batch_size,
+    )
+    pending = deque()
+    stats = {"records": 0, "chunks": 0}
+    started = time.perf_counter()
+
+    async def write_oldest():
+        batch, task = pending.popleft()
+        vectors = await task
+        await loop.run_in_executor(None, writer.write, batch, vectors)
+        position = batch[-1]["position"] + 1
+        save_checkpoint(checkpoint_path, position)
+        stats["records"] = position - start
+        stats["chunks"] += len(batch)
+        elapsed = time.perf_counter() - started
+        logging.info("Ingested %s records, %s chunks, %.1f docs/sec",
+                     stats["records"], stats["chunks"], stats["records"] / elapsed)
+
+    try:
+        for batch in batches:
+            task = asyncio.ensure_future(embeddings.aembed_documents([chunk["text"] for chunk in batch]))
+            pending.append((batch, task))
+            if len(pending) >= concurrency:
+                await write_oldest()
+        while pending:
+            await write_oldest()
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+    elapsed = time.perf_counter() - started
+    stats.update(
+        seconds=round(elapsed, 3),
+        docs_per_sec=round(stats["records"] / elapsed, 1) if elapsed else 0.0,
+        chunks_per_sec=round(stats["chunks"] / elapsed, 1) if elapsed else 0.0,
+    )
+    return stats
+
+
+def load_checkpoint(checkpoint_path: str) -> int:
+    """
+    Returns the number of records already ingested according to the checkpoint file.
+    """
+    if not os.path.exists(checkpoint_path):
+        return 0
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        return json.load(f)["records"]
+
+
+def save_checkpoint(checkpoint_path: str, records: int) -> None:
+    tmp_path = f"{checkpoint_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"records": records}, f)
+    os.replace(tmp_path, checkpoint_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="JSONL or CSV file of documents")
+    parser.add_argument("--index", required=True, help="target index name")
+    parser.add_argument("--backend", choices=["elasticsearch", "local"], default="elasticsearch")
+    parser.add_argument("--text-field", default="text", help="field holding the text to embed")
+    parser.add_argument("--id-field", help="field holding the document id, the line number is used otherwise")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="characters per chunk")
+    parser.add_argument("--chunk-overlap", type=int, default=100, help="characters shared by consecutive chunks")
+    parser.add_argument("--batch-size", type=int, default=256, help="chunks per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="embedding requests in flight")
+    parser.add_argument("--bulk-threads", type=int, default=4, help="parallel_bulk threads")
+    parser.add_argument("--checkpoint", help="checkpoint file, defaults to <path>.checkpoint.json")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start over")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from langchain_openai import OpenAIEmbeddings
+    from database_setup import get_es_client, get_vector_store
+
+    checkpoint_path = args.checkpoint or f"{args.path}.checkpoint.json"
+    if args.restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    if args.backend == "local":
+        writer = LocalWriter(get_vector_store(args.index, "local"))
+    else:
+        writer = ElasticsearchWriter(get_es_client(), args.index, thread_count=args.bulk_threads)
+
+    # Documents are embedded once, so they bypass the shared query embedding cache
+    embeddings = OpenAIEmbeddings(api_key=os.environ.get("OPENAI_API_KEY"))
+    stats = asyncio.run(ingest(
+        args.path, writer, embeddings, args.text_field, args.id_field, checkpoint_path,
+        args.chunk_size, args.chunk_overlap, args.batch_size, args.concurrency,
+    ))
+    print(json.dumps(stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+"""
+Local Vector Store - local_vector_store
+
+An in-process alternative to ElasticsearchStore for small and medium indexes.
+Normalized float32 embeddings live in a memory-mapped .npy matrix, texts and
+metadata in a .docs.jsonl sidecar, and the store state in a .json header.
+Search is an exact cosine search over the matrix, or an IVF search over the
+nearest k-means partitions once an index is trained with build_ivf.
+
+Import an Elasticsearch index with:
+    python source/local_vector_store.py azal_activities
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import uuid
+from typing import Any, Iterable, List, Optional, Tuple
+
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from logger import logging
+
+# Directory holding one set of files per local index
+LOCAL_VECTOR_DIR = os.environ.get("LOCAL_VECTOR_DIR", os.path.join(os.getcwd(), ".vector_store"))
+
+
+class LocalVectorStore(VectorStore):
+    """
+    Vector store kept in memory-mapped files next to the process.
+
+    Relevance scores are (1 + cosine) / 2, the score Elasticsearch returns for
+    cosine similarity, so score thresholds carry over between the backends.
+
+    Attributes:
+        path (str): Path prefix of the index files.
+        embedding (Embeddings): Embeds texts and queries.
+        dim (int): Dimension of the embeddings, known after the first write.
+        count (int): Number of stored documents.
+    """
+    def __init__(self, path: str, embedding: Embeddings):
+        self.path = path
+        self.embedding = embedding
+        self.dim = None
+        self.count = 0
+        self.nprobe = 8
+        self._vectors = None
+        self._docs = []
+        self._centroids = None
+        self._lists = None
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """
+        Embeds and stores texts.
+
+        Args:
+            texts (Iterable[str]): The texts to store.
+            metadatas (List[dict], optional): One metadata dictionary per text.
+            ids (List[str], optional): One id per text, generated when missing.
+
+        Returns:
+            List[str]: The ids of the stored texts.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    async def aadd_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                         ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        vectors = await self.embedding.aembed_documents(texts)
+        return self.add_embeddings(texts, vectors, metadatas, ids)
+
+    def add_embeddings(self, texts: List[str], vectors, metadatas: Optional[List[dict]] = None,
+                       ids: Optional[List[str]] = None) -> List[str]:
+        """
+        Stores texts whose embeddings are already computed.
+
+        Args:
+            texts (List[str]): The texts to store.
+            vectors: Their embeddings, one row per text.
+            metadatas (List[dict], optional): One metadata dictionary per text.
+            ids (List[str], optional): One id per text, generated when missing.
+
+        Returns:
+            List[str]: The ids of the stored texts.
+        """
+        vectors = self._normalize(np.asarray(vectors, dtype=np.float32))
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [uuid.uuid4().hex for _ in texts]
+
+        with self._lock:
+            if self._vectors is None:
+                self.dim = vectors.shape[1]
+            self._reserve(self.count + len(texts))
+            self._vectors[self.count:self.count + len(texts)] = vectors
+            with open(f"{self.path}.docs.jsonl", "a", encoding="utf-8") as f:
+                for doc_id, text, metadata in zip(ids, texts, metadatas):
+                    doc = {"id": doc_id, "text": text, "metadata": metadata}
+                    f.write(json.dumps(doc) + "\n")
+                    self._docs.append(doc)
+            start = self.count
+            self.count += len(texts)
+            if self._centroids is not None:
+                self._assign(start, self.count)
+            self._vectors.flush()
+            self._write_header()
+        return ids
+
+    def get_ids(self) -> set:
+        """
+        Returns the ids of the stored texts.
+
+        Returns:
+            set: The ids.
+        """
+        with self._lock:
+            return {doc["id"] for doc in self._docs}
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_relevance_scores(query, k=k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(self.embedding.embed_query(query), k=k)
+
+    def _similarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                 **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score(query, k=k)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k=k)]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: List[float], k: int = 4,
+                                                          **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        Returns the documents most similar to an embedding, with their relevance scores.
+
+        Args:
+            embedding (List[float]): The query embedding.
+            k (int): Number of documents to return.
+
+        Returns:
+            List[Tuple[Document, float]]: The documents and their scores, best first.
+        """
+        return self.search_many([embedding], k=k)[0]
+
+    def search_many(self, embeddings, k: int = 4) -> List[List[Tuple[Document, float]]]:
+        """
+        Searches a batch of query embeddings with one matrix product.
+
+        Args:
+            embeddings: The query embeddings, one row per query.
+            k (int): Number of documents to return per query.
+
+        Returns:
+            List[List[Tuple[Document, float]]]: Per query, the documents and their scores, best first.
+        """
+        queries = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1))
+        if self.count == 0:
+            return [[] for _ in queries]
+        vectors = self._vectors[:self.count]
+
+        if self._centroids is None:
+            candidates = [None] * len(queries)
+            scores = queries @ vectors.T
+        else:
+            probes = np.argsort(-(queries @ self._centroids.T), axis=1)[:, :self.nprobe]
+            candidates = [np.concatenate([self._lists[p] for p in row]) for row in probes]
+            scores = [vectors[rows] @ query for rows, query in zip(candidates, queries)]
+
+        results = []
+        for rows, row_scores in zip(candidates, scores):
+            top = self._top_k(row_scores, k)
+            indices = top if rows is None else rows[top]
+            results.append([(self._document(i), float((1 + row_scores[j]) / 2)) for i, j in zip(indices, top)])
+        return results
+
+    def build_ivf(self, nlist: Optional[int] = None, nprobe: int = 8) -> None:
+        """
+        Partitions the stored vectors with k-means so searches only scan the nearest partitions.
+
+        Args:
+            nlist (int, optional): Number of partitions, defaults to about sqrt(count).
+            nprobe (int): Number of partitions scanned per query.
+        """
+        from sklearn.cluster import MiniBatchKMeans
+
+        with self._lock:
+            nlist = min(nlist or int(np.sqrt(self.count)) or 1, self.count)
+            kmeans = MiniBatchKMeans(n_clusters=nlist, random_state=42, n_init="auto")
+            kmeans.fit(self._vectors[:self.count])
+            self._centroids = self._normalize(kmeans.cluster_centers_.astype(np.float32))
+            self.nprobe = nprobe
+            self._assign(0, self.count)
+            np.save(f"{self.path}.ivf.npy", self._centroids)
+            self._write_header()
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   path: str = None, **kwargs: Any) -> "LocalVectorStore":
+        store = cls(path or os.path.join(LOCAL_VECTOR_DIR, uuid.uuid4().hex), embedding)
+        store.add_texts(texts, metadatas)
+        return store
+
+    @classmethod
+    def from_elasticsearch(cls, es_client, index_name: str, embedding: Embeddings, path: str = None,
+                           text_field: str = "text", vector_field: str = "vector",
+                           batch_size: int = 1000) -> "LocalVectorStore":
+        """
+        Copies an ElasticsearchStore index, embeddings included, into a new local store.
+
+        Args:
+            es_client (Elasticsearch): Client of the cluster holding the index.
+            index_name (str): The index to copy.
+            embedding (Embeddings): Embeds the queries of the local store.
+            path (str, optional): Path prefix of the local index, defaults to LOCAL_VECTOR_DIR/index_name.
+            text_field (str): Field holding the text of a document.
+            vector_field (str): Field holding the embedding of a document.
+            batch_size (int): Documents read per scroll page and written per batch.
+
+        Returns:
+            LocalVectorStore: The local copy.
+        """
+        from elasticsearch.helpers import scan
+
+        path = path or os.path.join(LOCAL_VECTOR_DIR, index_name)
+        for suffix in (".npy", ".docs.jsonl", ".json", ".ivf.npy"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        store = cls(path, embedding)
+
+        texts, vectors, metadatas, ids = [], [], [], []
+        for hit in scan(es_client, index=index_name, size=batch_size, query={"query": {"match_all": {}}}):
+            source = hit["_source"]
+            texts.append(source.get(text_field, ""))
+            vectors.append(source[vector_field])
+            metadatas.append(source.get("metadata", {}))
+            ids.append(hit["_id"])
+            if len(texts) >= batch_size:
+                store.add_embeddings(texts, vectors, metadatas, ids)
+                texts, vectors, metadatas, ids = [], [], [], []
+        if texts:
+            store.add_embeddings(texts, vectors, metadatas, ids)
+
+        logging.info("Imported %s documents of %s into %s", store.count, index_name, path)
+        return store
+
+    def _document(self, index: int) -> Document:
+        doc = self._docs[index]
+        return Document(page_content=doc["text"], metadata=doc["metadata"])
+
+    def _reserve(self, size: int) -> None:
+        """
+        Grows the memory-mapped matrix, doubling its capacity, to hold at least size rows.
+        """
+        capacity = 0 if self._vectors is None else self._vectors.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2, 1024)
+        tmp_path = f"{self.path}.tmp.npy"
+        vectors = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(new_capacity, self.dim))
+        if self.count:
+            vectors[:self.count] = self._vectors[:self.count]
+        vectors.flush()
+        del vectors
+        os.replace(tmp_path, f"{self.path}.npy")
+        self._vectors = np.lib.format.open_memmap(f"{self.path}.npy", mode="r+")
+
+    def _assign(self, start: int, end: int) -> None:
+        """
+        Adds the rows start:end to the inverted list of their nearest centroid.
+        """
+        nearest = np.argmax(self._vectors[start:end] @ self._centroids.T, axis=1)
+        if self._lists is None or start == 0:
+            self._lists = [np.empty(0, dtype=np.int64) for _ in range(len(self._centroids))]
+        for partition in np.unique(nearest):
+            rows = np.flatnonzero(nearest == partition) + start
+            self._lists[partition] = np.concatenate([self._lists[partition], rows])
+
+    def _load(self) -> None:
+        if not os.path.exists(f"{self.path}.json"):
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            return
+        with open(f"{self.path}.json", "r", encoding="utf-8") as f:
+            header = json.load(f)
+        self.dim = header["dim"]
+        self.count = header["count"]
+        self.nprobe = header.get("nprobe", 8)
+        self._vectors = np.lib.format.open_memmap(f"{self.path}.npy", mode="r+")
+        with open(f"{self.path}.docs.jsonl", "rb+") as f:
+            self._docs = [json.loads(f.readline()) for _ in range(self.count)]
+            end = f.tell()
+            # Documents appended by a write that died before its header are dropped, so the
+            # next append lines up with its vector rows again
+            if f.seek(0, os.SEEK_END) > end:
+                logging.warning("Dropping documents of %s written after its last header", self.path)
+                f.truncate(end)
+        if os.path.exists(f"{self.path}.ivf.npy"):
+            self._centroids = np.load(f"{self.path}.ivf.npy")
+            self._assign(0, self.count)
+
+    def _write_header(self) -> None:
+        tmp_path = f"{self.path}.json.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dim": self.dim, "count": self.count, "nprobe": self.nprobe}, f)
+        os.replace(tmp_path, f"{self.path}.json")
+
+    @staticmethod
+    def _normalize(vectors):
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    @staticmethod
+    def _top_k(scores, k: int):
+        """
+        Returns the positions of the k highest scores, best first.
+        """
+        k = min(k, len(scores))
+        if k == 0:
+            return np.empty(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import an Elasticsearch index into a local vector store.")
+    parser.add_argument("index_name", help="the Elasticsearch index to copy")
+    parser.add_argument("--path", help="path prefix of the local index")
+    parser.add_argument("--ivf", action="store_true", help="partition the imported index for IVF search")
+    parser.add_argument("--nlist", type=int, help="number of IVF partitions")
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from database_setup import get_embeddings, get_es_client
+
+    store = LocalVectorStore.from_elasticsearch(get_es_client(), args.index_name, get_embeddings(), path=args.path)
+    if args.ivf:
+        store.build_ivf(args.nlist)
+
+
+if __name__ == "__main__":
+    main()
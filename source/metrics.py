@@ -0,0 +1,142 @@
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+
+# Application of the request being served, set by the API handlers
+current_app_id = ContextVar("current_app_id", default="unknown")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_SECONDS = Histogram(
+    "agent_stage_seconds",
+    "Latency of each stage of an agent turn",
+    ["app_id", "stage"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "agent_stage_errors_total",
+    "Stages of an agent turn that raised",
+    ["app_id", "stage"],
+)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_time_to_first_token_seconds",
+    "Time from the start of an LLM call to its first streamed token",
+    ["app_id", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_SECONDS = Histogram(
+    "llm_request_seconds",
+    "Total time of an LLM call",
+    ["app_id", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "scheduler_queue_wait_seconds",
+    "Time an agent run waited for a slot",
+    ["app_id"],
+    buckets=LATENCY_BUCKETS,
+)
+SCHEDULER_REJECTIONS = Counter(
+    "scheduler_rejections_total",
+    "Agent runs rejected because the queue of the application was full",
+    ["app_id"],
+)
+
+
+@contextmanager
+def observe(stage: str, app_id: Optional[str] = None):
+    """
+    Times a stage of a turn into the agent_stage_seconds histogram.
+
+    Args:
+        stage (str): Name of the stage, e.g. "settings_fetch" or "tool_web_search".
+        app_id (str, optional): The application, defaults to the one of the current request.
+    """
+    app_id = app_id or current_app_id.get()
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.labels(app_id, stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(app_id, stage).observe(time.perf_counter() - start)
+
+
+def record_queue_wait(app_id: str, seconds: float) -> None:
+    QUEUE_WAIT_SECONDS.labels(app_id).observe(seconds)
+
+
+def record_rejection(app_id: str) -> None:
+    SCHEDULER_REJECTIONS.labels(app_id).inc()
+
+
+def render_metrics() -> tuple:
+    """
+    Renders every metric in the Prometheus text format.
+
+    When PROMETHEUS_MULTIPROC_DIR is set, the metrics of all worker processes are aggregated.
+
+    Returns:
+        tuple: The payload and its content type.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    Records the time to first token and the total time of every LLM call.
+
+    Attach it to a model; calls are labelled with the application of the
+    current request and the model name.
+    """
+    # Cheap enough to run on the event loop instead of a worker thread
+    run_inline = True
+
+    def __init__(self):
+        self._runs = {}
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        self._start(serialized, run_id)
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id: UUID,
+                            **kwargs: Any) -> None:
+        self._start(serialized, run_id)
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is not None and not run["first_token"]:
+            run["first_token"] = True
+            LLM_FIRST_TOKEN_SECONDS.labels(run["app_id"], run["model"]).observe(time.perf_counter() - run["start"])
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            LLM_SECONDS.labels(run["app_id"], run["model"]).observe(time.perf_counter() - run["start"])
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is not None:
+            STAGE_ERRORS.labels(run["app_id"], "llm").inc()
+
+    def _start(self, serialized: Dict[str, Any], run_id: UUID) -> None:
+        model_kwargs = (serialized or {}).get("kwargs", {})
+        model = model_kwargs.get("model_name") or model_kwargs.get("model")
+        self._runs[run_id] = {
+            "start": time.perf_counter(),
+            "app_id": current_app_id.get(),
+            "model": str(model or "unknown"),
+            "first_token": False,
+        }
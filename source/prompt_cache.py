@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.load.load import loads
+from langchain_core.prompts import BasePromptTemplate
+
+from cache import LRUCache
+from logger import logging
+
+
+class PromptCache:
+    """
+    Two-tier cache for LangChain hub prompts.
+
+    Prompts are kept deserialized in an in-memory LRU and as raw hub manifests in
+    an on-disk store, so a restarted worker can serve them without hub access.
+    Entries past a fraction of their TTL are refreshed in the background while the
+    cached copy keeps being served; entries past their TTL are fetched again and the
+    stale copy is only used if the hub cannot be reached.
+
+    Attributes:
+        cache_dir (str): Directory holding the serialized prompt manifests.
+        ttl (float): Default time to live of an entry in seconds.
+        refresh_ahead (float): Fraction of the TTL after which a background refresh starts.
+        offline (bool): When True the hub is never contacted and only disk entries are served.
+    """
+    def __init__(self, cache_dir: str, ttl: float = 3600, refresh_ahead: float = 0.8,
+                 offline: bool = False, maxsize: int = 128):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.offline = offline
+        self._memory = LRUCache(maxsize=maxsize)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prompt-refresh")
+
+    def get(self, prompt_id: str, ttl: float = None) -> BasePromptTemplate:
+        """
+        Returns a prompt, fetching it from the hub only when no fresh copy is cached.
+
+        Args:
+            prompt_id (str): The ID of the prompt to fetch.
+            ttl (float, optional): Time to live for this entry, defaults to the cache TTL.
+
+        Returns:
+            BasePromptTemplate: The fetched prompt.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        entry = self._memory.get(prompt_id)
+        if entry is None:
+            entry = self._read_disk(prompt_id)
+            if entry is not None:
+                self._memory.set(prompt_id, entry)
+
+        if entry is not None:
+            age = time.time() - entry["fetched_at"]
+            if self.offline or age < ttl:
+                if not self.offline and age >= ttl * self.refresh_ahead:
+                    self._schedule_refresh(prompt_id)
+                return entry["prompt"]
+
+        if self.offline:
+            raise LookupError(f"Prompt {prompt_id} is not cached and prompt cache is offline")
+
+        try:
+            entry = self._fetch(prompt_id)
+        except Exception as e:
+            if entry is None:
+                raise
+            logging.warning("Serving stale prompt %s, hub fetch failed: %s", prompt_id, e)
+            return entry["prompt"]
+        return entry["prompt"]
+
+    def warm(self, prompt_ids) -> None:
+        """
+        Fetches prompts into both tiers ahead of time.
+
+        Args:
+            prompt_ids (list): The IDs of the prompts to fetch.
+        """
+        for prompt_id in prompt_ids:
+            self._fetch(prompt_id)
+
+    def invalidate(self, prompt_id: str) -> None:
+        """
+        Removes a prompt from both tiers.
+
+        Args:
+            prompt_id (str): The ID of the prompt to remove.
+        """
+        self._memory.pop(prompt_id)
+        path = self._path(prompt_id)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _fetch(self, prompt_id: str) -> dict:
+        """
+        Pulls a prompt manifest from the hub and stores it in both tiers.
+        """
+        from langchainhub import Client
+
+        client = Client()
+        if hasattr(client, "pull_repo"):
+            record = client.pull_repo(prompt_id)
+        else:
+            record = {"manifest": json.loads(client.pull(prompt_id))}
+        record["fetched_at"] = time.time()
+
+        entry = {"prompt": self._load(record), "fetched_at": record["fetched_at"]}
+        self._memory.set(prompt_id, entry)
+        self._write_disk(prompt_id, record)
+        logging.info("Fetched prompt %s from the hub", prompt_id)
+        return entry
+
+    def _schedule_refresh(self, prompt_id: str) -> None:
+        """
+        Refreshes a prompt in the background unless a refresh is already running.
+        """
+        with self._lock:
+            if prompt_id in self._refreshing:
+                return
+            self._refreshing.add(prompt_id)
+
+        def refresh():
+            try:
+                self._fetch(prompt_id)
+            except Exception as e:
+                logging.warning("Background refresh of prompt %s failed: %s", prompt_id, e)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(prompt_id)
+
+        self._executor.submit(refresh)
+
+    @staticmethod
+    def _load(record: dict) -> BasePromptTemplate:
+        """
+        Deserializes a hub manifest the same way hub.pull does.
+        """
+        obj = loads(json.dumps(record["manifest"]))
+        if isinstance(obj, BasePromptTemplate) and "owner" in record:
+            if obj.metadata is None:
+                obj.metadata = {}
+            obj.metadata["lc_hub_owner"] = record["owner"]
+            obj.metadata["lc_hub_repo"] = record["repo"]
+            obj.metadata["lc_hub_commit_hash"] = record["commit_hash"]
+        return obj
+
+    def _path(self, prompt_id: str) -> str:
+        digest = hashlib.sha256(prompt_id.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def _read_disk(self, prompt_id: str):
+        path = self._path(prompt_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                record = json.load(f)
+            return {"prompt": self._load(record), "fetched_at": record["fetched_at"]}
+        except Exception as e:
+            logging.warning("Ignoring unreadable cached prompt %s: %s", prompt_id, e)
+            return None
+
+    def _write_disk(self, prompt_id: str, record: dict) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(prompt_id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp_path, path)
+
+
+prompt_cache = PromptCache(
+    cache_dir=os.environ.get("PROMPT_CACHE_DIR", os.path.join(os.getcwd(), ".prompt_cache")),
+    ttl=float(os.environ.get("PROMPT_CACHE_TTL", 3600)),
+    refresh_ahead=float(os.environ.get("PROMPT_CACHE_REFRESH_AHEAD", 0.8)),
+    offline=os.environ.get("PROMPT_CACHE_OFFLINE", "false").lower() in ("1", "true", "yes"),
+)
@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import os
+
+import numpy as np
+
+from cache import TTLCache
+from database_setup import get_embeddings, get_vector_store
+from logger import logging
+from metrics import observe
+
+# Hit lists keyed by (index, query embedding, retrieval options), shared by every retriever
+retrieval_cache = TTLCache(
+    maxsize=int(os.getenv('RETRIEVAL_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('RETRIEVAL_CACHE_TTL', 120)),
+)
+
+DEFAULT_RETRIEVAL_SETTINGS = {
+    "index_name": "azal_activities",
+    "backend": "elasticsearch",
+    "k": 4,
+    "score_threshold": None,
+    "fields": [],
+}
+
+
+class DatabaseRetriever:
+    def __init__(self, settings: dict, tool_name: str = "azal_database_tool"):
+        """
+        Initializes the DatabaseRetriever with the provided settings.
+
+        The retrieval options are read from settings["Tools"][tool_name]:
+        "index_name", "backend" ("elasticsearch" or "local"), "k",
+        "score_threshold" (minimum relevance score of a hit)
+        and "fields" (metadata fields kept in the results).
+
+        Args:
+            settings (dict): Dictionary containing settings of the application.
+            tool_name (str): The tool whose retrieval options are used.
+        """
+        options = settings.get("Tools", {}).get(tool_name) or {}
+        self.options = {**DEFAULT_RETRIEVAL_SETTINGS, **options}
+
+    def retrieve(self, question: str) -> list:
+        """
+        Retrieves the documents most relevant to a question.
+
+        Args:
+            question (str): The question to search for.
+
+        Returns:
+            list: The compact hits, each with its content and the projected metadata fields.
+        """
+        with observe("query_embedding"):
+            embedding = get_embeddings().embed_query(question)
+        key = self._cache_key(embedding)
+        hits = retrieval_cache.get(key)
+        if hits is None:
+            hits = self._search(embedding)
+            retrieval_cache.set(key, hits)
+        return hits
+
+    async def aretrieve(self, question: str) -> list:
+        """
+        Async variant of retrieve.
+
+        The query is embedded asynchronously and the Elasticsearch request runs on
+        the default executor, so the event loop is not blocked while it waits.
+
+        Args:
+            question (str): The question to search for.
+
+        Returns:
+            list: The compact hits, each with its content and the projected metadata fields.
+        """
+        with observe("query_embedding"):
+            embedding = await get_embeddings().aembed_query(question)
+        key = self._cache_key(embedding)
+        hits = retrieval_cache.get(key)
+        if hits is None:
+            # to_thread keeps the app_id of the request for the vector_search metrics
+            hits = await asyncio.to_thread(self._search, embedding)
+            retrieval_cache.set(key, hits)
+        return hits
+
+    def _search(self, embedding: list) -> list:
+        """
+        Searches the index with a query embedding and projects the hits.
+        """
+        store = get_vector_store(self.options["index_name"], self.options["backend"])
+        with observe("vector_search"):
+            results = store.similarity_search_by_vector_with_relevance_scores(embedding, k=int(self.options["k"]))
+        threshold = self.options["score_threshold"]
+        hits = [
+            self.compact(doc, score, self.options["fields"])
+            for doc, score in results
+            if threshold is None or score >= threshold
+        ]
+        logging.info("Retrieved %s of %s hits from %s", len(hits), len(results), self.options["index_name"])
+        return hits
+
+    def _cache_key(self, embedding: list) -> tuple:
+        """
+        Returns the cache key of a query embedding under the current retrieval options.
+        """
+        digest = hashlib.sha256(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+        return (
+            self.options["index_name"],
+            self.options["backend"],
+            digest,
+            int(self.options["k"]),
+            self.options["score_threshold"],
+            tuple(self.options["fields"]),
+        )
+
+    @staticmethod
+    def compact(doc, score: float, fields: list) -> dict:
+        """
+        Keeps the content of a document, its score and only the requested metadata fields.
+
+        Args:
+            doc (Document): The retrieved document.
+            score (float): Its relevance score.
+            fields (list): The metadata fields to keep.
+
+        Returns:
+            dict: The compact hit.
+        """
+        hit = {"content": doc.page_content, "score": round(float(score), 4)}
+        for field in fields:
+            if field in doc.metadata:
+                hit[field] = doc.metadata[field]
+        return hit
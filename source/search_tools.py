@@ -1,15 +1,74 @@
 import os
 import re
 
+import aiohttp
 from langchain_community.utilities import GoogleSerperAPIWrapper
 
 from custom_chains import ChainHandler
+from cache import TTLCache
 from logger import logging
+from metrics import observe
 
 #Fetching the API from environment Variables
 SERPER_API_KEY = os.getenv('SERPER_API_KEY')
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Search results keyed by (website_url, normalized query), shared by every SearchTool
+search_cache = TTLCache(
+    maxsize=int(os.getenv('SEARCH_CACHE_SIZE', 1024)),
+    ttl=float(os.getenv('SEARCH_CACHE_TTL', 900)),
+)
+
+# One Serper wrapper and one keep-alive HTTP connection pool shared by every search
+_serper_api = None
+_http_session = None
+
+
+def get_serper_api() -> GoogleSerperAPIWrapper:
+    """
+    Returns the shared Serper API wrapper, creating it on first use.
+
+    Returns:
+        GoogleSerperAPIWrapper: The shared wrapper.
+    """
+    global _serper_api
+    if _serper_api is None:
+        _serper_api = GoogleSerperAPIWrapper()
+    return _serper_api
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Returns the shared keep-alive HTTP session used for async searches.
+
+    Must be called from the event loop that will use the session.
+
+    Returns:
+        aiohttp.ClientSession: The pooled HTTP session.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=int(os.getenv('SEARCH_HTTP_POOL_SIZE', 100)),
+            keepalive_timeout=30,
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=float(os.getenv('SEARCH_HTTP_TIMEOUT', 15))),
+        )
+        get_serper_api().aiosession = _http_session
+    return _http_session
+
+
+async def close_http_session():
+    """
+    Closes the shared HTTP session and its pooled connections.
+    """
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
 class SearchTool:
     def __init__(self, settings: dict):
         """
@@ -19,7 +78,7 @@ class SearchTool:
             settings (dict): Dictionary containing settings for the SearchTool.
         """
         self.settings= settings
-        self.serper_api = GoogleSerperAPIWrapper()
+        self.serper_api = get_serper_api()
         
     def perform_search(self, query: str):
         """
@@ -34,16 +93,106 @@ class SearchTool:
         # website_url = self.settings.get("website_url", "")  # Extracting the website URL from settings
         # Accessing the website_url
         website_url = self.settings['Tools']['wb_tool']['website_url']
-        print("++++++WEBSITE URL+++++++++")
-        print(website_url)
+        logging.debug(f"Website URL: {website_url}")
+        cache_key = (website_url, self.normalize_query(query))
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Search cache hit for query: {query}")  # Logging cache hit
+            return cached
+
         modified_query = f"{website_url} {query}"  # Modifying query to include website URL
         logging.info(f"Performing search for query: {modified_query}")  # Logging search query
-        response = self.serper_api.run(query=modified_query)  # Running the search query
-        results = self.serper_api.results(modified_query)  # Retrieving search results
+        with observe("serper_search"):
+            results = self.serper_api.results(modified_query)  # Retrieving search results in a single call
+        response = self._format_results(results, self.serper_api.k)  # Formatting the snippets like serper_api.run
         logging.info("Search completed successfully.")  # Logging search completion
-        return response, self._extract_urls(results)  # Returning search response and extracted URLs
+        search_result = (response, self._extract_urls(results))
+        search_cache.set(cache_key, search_result)
+        return search_result  # Returning search response and extracted URLs
+
+    async def aperform_search(self, query: str):
+        """
+        Async variant of perform_search using the shared HTTP connection pool.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            tuple: A tuple containing the search response and a list of extracted URLs.
+        """
+        website_url = self.settings['Tools']['wb_tool']['website_url']
+        logging.debug(f"Website URL: {website_url}")
+        cache_key = (website_url, self.normalize_query(query))
+        cached = search_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"Search cache hit for query: {query}")  # Logging cache hit
+            return cached
+
+        modified_query = f"{website_url} {query}"  # Modifying query to include website URL
+        logging.info(f"Performing async search for query: {modified_query}")  # Logging search query
+        get_http_session()  # Making sure the wrapper uses the pooled session of this loop
+        with observe("serper_search"):
+            results = await self.serper_api.aresults(modified_query)  # Retrieving search results in a single call
+        response = self._format_results(results, self.serper_api.k)  # Formatting the snippets like serper_api.run
+        logging.info("Search completed successfully.")  # Logging search completion
+        search_result = (response, self._extract_urls(results))
+        search_cache.set(cache_key, search_result)
+        return search_result  # Returning search response and extracted URLs
+
+    @staticmethod
+    def normalize_query(query: str):
+        """
+        Normalizes a query so that trivially different phrasings share a cache entry.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            str: The lower-cased query with collapsed whitespace and no trailing punctuation.
+        """
+        return " ".join(query.lower().split()).rstrip("?!. ")
     
     
+    @staticmethod
+    def _format_results(results: dict, k: int):
+        """
+        Joins the snippets of search results into the text serper_api.run returns.
+
+        Args:
+            results (dict): The search results.
+            k (int): Number of organic results to use.
+
+        Returns:
+            str: The answer box answer, or the knowledge graph and organic snippets.
+        """
+        answer_box = results.get('answerBox') or {}
+        if answer_box.get('answer'):
+            return answer_box['answer']
+        if answer_box.get('snippet'):
+            return answer_box['snippet'].replace("\n", " ")
+        if answer_box.get('snippetHighlighted'):
+            return " ".join(answer_box['snippetHighlighted'])
+
+        snippets = []
+        knowledge_graph = results.get('knowledgeGraph') or {}
+        title = knowledge_graph.get('title')
+        if knowledge_graph.get('type'):
+            snippets.append(f"{title}: {knowledge_graph['type']}.")
+        if knowledge_graph.get('description'):
+            snippets.append(knowledge_graph['description'])
+        for attribute, value in knowledge_graph.get('attributes', {}).items():
+            snippets.append(f"{title} {attribute}: {value}.")
+
+        for result in results.get('organic', [])[:k]:
+            if 'snippet' in result:
+                snippets.append(result['snippet'])
+            for attribute, value in result.get('attributes', {}).items():
+                snippets.append(f"{attribute}: {value}.")
+
+        if not snippets:
+            return "No good Google Search Result was found"
+        return " ".join(snippets)
+
     @staticmethod
     def _extract_urls(results: dict):
         """
@@ -105,9 +254,29 @@ class WebSearchTool:
         logging.info("Search response cleaned successfully.")  # Logging search response cleaning
         # chain = self.chain_handler.create_chain(prompt_id=self.settings.get("prompt_id"))  # Creating a chain
         chain = self.chain_handler.create_chain(prompt_id=self.settings["Tools"]["wb_tool"]["prompt_id"])
-        results = chain.invoke({"question": query, "context": (search_response, urls)})  # Invoking the chain
+        with observe("search_chain"):
+            results = chain.invoke({"question": query, "context": (search_response, urls)})  # Invoking the chain
         logging.info("Web search tool execution completed.")  # Logging web search tool completion
         return results  # Returning the results of the web search
+
+    async def awb_tool(self, query: str):
+        """
+        Executes the web search tool without blocking the event loop.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            object: Results of the web search.
+        """
+        logging.info(f"Executing async web search tool for query: {query}")  # Logging web search execution
+        search_response, urls = await self.search_tool.aperform_search(query)  # Performing search using SearchTool
+        search_response = self.search_tool.clean_text(search_response)  # Cleaning the search response
+        chain = self.chain_handler.create_chain(prompt_id=self.settings["Tools"]["wb_tool"]["prompt_id"])
+        with observe("search_chain"):
+            results = await chain.ainvoke({"question": query, "context": (search_response, urls)})  # Invoking the chain
+        logging.info("Async web search tool execution completed.")  # Logging web search tool completion
+        return results  # Returning the results of the web search
     
 
 # if __name__ =="__main__":
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+from database_setup import get_embeddings
+from logger import logging
+
+DEFAULT_SEMANTIC_CACHE_SETTINGS = {
+    "enabled": False,
+    "threshold": 0.92,
+    "ttl": 3600,
+    "max_entries": 1000,
+}
+
+
+class SemanticCache:
+    """
+    Answers to recent queries of one application, looked up by query similarity.
+
+    Query embeddings are kept normalized in a matrix, so a lookup is a single
+    matrix-vector product. Entries expire after the TTL; when the cache is full
+    the least recently used entry is replaced.
+
+    Attributes:
+        threshold (float): Minimum cosine similarity for a cached answer to be returned.
+        ttl (float): Seconds an answer is kept.
+        max_entries (int): Maximum number of answers kept.
+    """
+    def __init__(self, threshold: float = 0.92, ttl: float = 3600, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._vectors = None
+        self._answers = [None] * max_entries
+        self._expires = np.zeros(max_entries)
+        self._used = np.zeros(max_entries)
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding) -> Optional[str]:
+        """
+        Returns the answer of the most similar unexpired query above the threshold.
+
+        Args:
+            embedding: The embedding of the incoming query.
+
+        Returns:
+            str: The cached answer, or None on a miss.
+        """
+        query = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is not None:
+                scores = self._vectors @ query
+                scores[self._expires <= now] = -1
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._used[best] = now
+                    self.hits += 1
+                    return self._answers[best]
+            self.misses += 1
+            return None
+
+    def store(self, embedding, answer: str) -> None:
+        """
+        Caches the answer of a query, replacing an expired or the least recently used entry.
+
+        Args:
+            embedding: The embedding of the query.
+            answer (str): The answer to cache.
+        """
+        vector = self._normalize(embedding)
+        now = time.monotonic()
+        with self._lock:
+            if self._vectors is None:
+                self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+            # Expired and never used slots have the oldest use time once their use time is reset
+            self._used[self._expires <= now] = 0
+            slot = int(np.argmin(self._used))
+            self._vectors[slot] = vector
+            self._answers[slot] = answer
+            self._expires[slot] = now + self.ttl
+            self._used[slot] = now
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the cache.
+        """
+        with self._lock:
+            size = int((self._expires > time.monotonic()).sum())
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+# One cache per application, rebuilt when its settings change
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def cache_settings(settings: dict) -> dict:
+    """
+    Returns the semantic cache settings of an application, with defaults filled in.
+
+    Args:
+        settings (dict): Settings of the application.
+
+    Returns:
+        dict: The "semantic_cache" section of the parent settings.
+    """
+    options = settings.get("parent_settings", {}).get("semantic_cache") or {}
+    return {**DEFAULT_SEMANTIC_CACHE_SETTINGS, **options}
+
+
+def get_semantic_cache(app_id: str, settings: dict) -> Optional[SemanticCache]:
+    """
+    Returns the semantic cache of an application, or None when it has not opted in.
+
+    Args:
+        app_id (str): The name of the application.
+        settings (dict): Settings of the application.
+
+    Returns:
+        SemanticCache: The cache of the application.
+    """
+    options = cache_settings(settings)
+    if not options["enabled"]:
+        return None
+    with _caches_lock:
+        if app_id not in _caches:
+            _caches[app_id] = SemanticCache(
+                threshold=float(options["threshold"]),
+                ttl=float(options["ttl"]),
+                max_entries=int(options["max_entries"]),
+            )
+        return _caches[app_id]
+
+
+def invalidate_semantic_cache(app_id: Optional[str]) -> None:
+    """
+    Drops the semantic cache of an application, its answers may depend on the old settings.
+
+    Args:
+        app_id (str, optional): The name of the application, None for every application.
+    """
+    with _caches_lock:
+        app_ids = list(_caches) if app_id is None else [app_id]
+        dropped = {key: _caches.pop(key) for key in app_ids if key in _caches}
+    for key, cache in dropped.items():
+        logging.info("Dropped semantic cache of app_id %s: %s", key, cache.stats())
+
+
+def semantic_cache_stats() -> dict:
+    """
+    Returns the counters of every semantic cache, keyed by application.
+    """
+    with _caches_lock:
+        caches = dict(_caches)
+    return {app_id: cache.stats() for app_id, cache in caches.items()}
+
+
+async def aembed_query(query: str):
+    """
+    Embeds a query with the shared cached embeddings.
+    """
+    return await get_embeddings().aembed_query(query)
@@ -4,13 +4,27 @@ from dotenv import load_dotenv
 from langchain_community.chat_message_histories import RedisChatMessageHistory
 
 import os
+from functools import lru_cache
 
 load_dotenv()
 
-# Use a pipeline as a high-level helper
-from transformers import pipeline
 
-pipe = pipeline("text-classification", model="Dmyadav2001/Sentimental-Analysis")
+@lru_cache(maxsize=None)
+def get_pipe():
+    """
+    Return the sentiment classification pipeline, loaded on first use.
+    """
+    # Use a pipeline as a high-level helper
+    from transformers import pipeline
+
+    return pipeline("text-classification", model="Dmyadav2001/Sentimental-Analysis")
+
+
+def __getattr__(name):
+    # Keeps `sentiment_analysis.pipe` working while the model is only loaded when first used
+    if name == "pipe":
+        return get_pipe()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Get the Redis URL from the environment variable
 redis_url = os.environ.get("REDIS_URL")
@@ -29,7 +43,7 @@ def get_sentiment(id:str):
     sentiment_prompt = PromptTemplate.from_template(prompt)
 
     # llm = OpenAI(temperature=0.5)
-    llm = pipe
+    llm = get_pipe()
 
     chain = (
         sentiment_prompt | llm
@@ -0,0 +1,222 @@
+"""
+Sentiment Service - sentiment_service
+
+A worker process loads the text-classification model once and serves every API
+worker through Redis: callers push one job per session on a queue, the worker
+micro-batches the queued jobs into a single forward pass and pushes each job's
+scores on a result key.
+
+Run the worker with:
+    python source/sentiment_service.py --processes 2
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+sys.path.insert(1, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+from langchain_core.messages import messages_from_dict
+
+from chat_history import PooledRedisChatMessageHistory, get_async_redis_client, get_redis_client
+from logger import logging
+
+load_dotenv()
+
+JOB_QUEUE = os.environ.get("SENTIMENT_QUEUE", "sentiment:jobs")
+RESULT_PREFIX = "sentiment:result:"
+SENTIMENT_MODEL = os.environ.get("SENTIMENT_MODEL", "Dmyadav2001/Sentimental-Analysis")
+
+# Characters per chunk, keeps every chunk under the 512 tokens of the model
+CHUNK_CHARS = int(os.environ.get("SENTIMENT_CHUNK_CHARS", 1500))
+
+
+def chunk_text(text: str, size: int = CHUNK_CHARS) -> list:
+    """
+    Split a message into chunks the model can score without truncation.
+
+    Args:
+        text (str): The message content.
+        size (int): Maximum number of characters of a chunk.
+
+    Returns:
+        list: The chunks, split on whitespace where possible.
+    """
+    chunks = []
+    while len(text) > size:
+        cut = text.rfind(" ", 0, size)
+        cut = cut if cut > 0 else size
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+def aggregate(labels: list, weights: list) -> dict:
+    """
+    Combine chunk scores into one label, weighting each chunk by its length.
+
+    Args:
+        labels (list): The classifier outputs ({"label", "score"}) of the chunks.
+        weights (list): The lengths of the chunks.
+
+    Returns:
+        dict: The winning label and its weighted score.
+    """
+    totals = defaultdict(float)
+    for output, weight in zip(labels, weights):
+        totals[output["label"]] += output["score"] * weight
+    label = max(totals, key=totals.get)
+    return {"label": label, "score": totals[label] / sum(weights)}
+
+
+async def get_sentiment_many(session_ids: list, timeout: float = 30) -> dict:
+    """
+    Score the human messages of many sessions through the sentiment worker.
+
+    Histories are read in one pipelined round trip, each message is chunked and
+    scored separately, and all sessions are queued together so the worker can
+    batch them into one forward pass.
+
+    Args:
+        session_ids (list): The sessions to analyze.
+        timeout (float): Seconds to wait for the worker before giving up.
+
+    Returns:
+        dict: Per session, the score of every human message and the overall label.
+    """
+    redis_client = get_async_redis_client()
+
+    pipe = redis_client.pipeline(transaction=False)
+    for session_id in session_ids:
+        pipe.lrange(PooledRedisChatMessageHistory(session_id=session_id).key, 0, -1)
+    histories = await pipe.execute()
+
+    jobs = {}
+    pipe = redis_client.pipeline(transaction=False)
+    for session_id, items in zip(session_ids, histories):
+        messages = messages_from_dict([json.loads(item) for item in items[::-1]])
+        messages = [message.content for message in messages if message.type == "human"]
+        chunks = [(index, chunk) for index, message in enumerate(messages) for chunk in chunk_text(message)]
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = (session_id, messages, chunks)
+        pipe.lpush(JOB_QUEUE, json.dumps({"id": job_id, "texts": [chunk for _, chunk in chunks]}))
+    await pipe.execute()
+
+    results = {}
+    pending = {RESULT_PREFIX + job_id: job_id for job_id in jobs}
+    deadline = time.monotonic() + timeout
+    while pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Sentiment worker did not answer for {len(pending)} session(s)")
+        popped = await redis_client.brpop(list(pending), timeout=max(1, int(remaining)))
+        if popped is None:
+            continue
+        key, payload = popped
+        job_id = pending.pop(key.decode("utf-8") if isinstance(key, bytes) else key)
+        session_id, messages, chunks = jobs[job_id]
+        results[session_id] = _session_result(messages, chunks, json.loads(payload))
+
+    return results
+
+
+def _session_result(messages: list, chunks: list, outputs: list) -> dict:
+    """
+    Group the chunk outputs of a session back into per-message and overall sentiment.
+    """
+    per_message = defaultdict(lambda: ([], []))
+    for (index, chunk), output in zip(chunks, outputs):
+        per_message[index][0].append(output)
+        per_message[index][1].append(len(chunk))
+
+    scored = []
+    for index, message in enumerate(messages):
+        if index in per_message:
+            scored.append({"message": message, **aggregate(*per_message[index])})
+
+    counts = defaultdict(int)
+    for message in scored:
+        counts[message["label"]] += 1
+    overall = max(counts, key=counts.get) if counts else None
+    return {"messages": scored, "counts": dict(counts), "overall": overall}
+
+
+def run_worker(batch_size: int = 64, max_wait: float = 0.02, max_jobs: int = 256):
+    """
+    Serve sentiment jobs forever, batching queued jobs into one forward pass.
+
+    Args:
+        batch_size (int): Chunks per forward pass of the model.
+        max_wait (float): Seconds to wait for more jobs once one has arrived.
+        max_jobs (int): Maximum number of jobs taken in one batch.
+    """
+    from transformers import pipeline
+
+    pipe = pipeline("text-classification", model=SENTIMENT_MODEL)
+    redis_client = get_redis_client()
+    logging.info("Sentiment worker %s serving %s", os.getpid(), JOB_QUEUE)
+
+    while True:
+        popped = redis_client.brpop(JOB_QUEUE, timeout=5)
+        if popped is None:
+            continue
+        jobs = [json.loads(popped[1])]
+
+        # Give concurrent callers a moment to queue their jobs into the same batch
+        deadline = time.monotonic() + max_wait
+        while len(jobs) < max_jobs:
+            more = redis_client.rpop(JOB_QUEUE, max_jobs - len(jobs))
+            if more:
+                jobs.extend(json.loads(item) for item in more)
+            elif time.monotonic() >= deadline:
+                break
+            else:
+                time.sleep(0.002)
+
+        texts = [text for job in jobs for text in job["texts"]]
+        try:
+            outputs = pipe(texts, batch_size=batch_size, truncation=True) if texts else []
+        except Exception as e:
+            logging.error("Sentiment batch of %s texts failed: %s", len(texts), e)
+            outputs = [{"label": "error", "score": 0.0} for _ in texts]
+
+        results = redis_client.pipeline(transaction=False)
+        offset = 0
+        for job in jobs:
+            job_outputs = outputs[offset:offset + len(job["texts"])]
+            offset += len(job["texts"])
+            results.lpush(RESULT_PREFIX + job["id"], json.dumps(job_outputs))
+            results.expire(RESULT_PREFIX + job["id"], 60)
+        results.execute()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the sentiment worker.")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes, one model copy each")
+    parser.add_argument("--batch-size", type=int, default=64, help="chunks per forward pass")
+    parser.add_argument("--max-wait", type=float, default=0.02, help="seconds to wait to fill a batch")
+    args = parser.parse_args()
+
+    if args.processes == 1:
+        run_worker(args.batch_size, args.max_wait)
+        return
+
+    processes = [
+        multiprocessing.Process(target=run_worker, args=(args.batch_size, args.max_wait))
+        for _ in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
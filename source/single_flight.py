@@ -0,0 +1,152 @@
+import asyncio
+import threading
+from typing import Awaitable, Callable, Hashable
+
+from logger import logging
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent identical calls into one execution.
+
+    The first caller of a key runs the function; callers arriving with the same
+    key while it is in flight wait for and share its result, or its exception.
+    Nothing is cached: once the call completes the next caller runs it again.
+
+    Attributes:
+        name (str): Name of the group, used in the metrics.
+        calls (int): Number of calls made.
+        executions (int): Number of calls that ran the function.
+        coalesced (int): Number of calls served by another call in flight.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+        self._tasks = {}
+        self._waiters = {}
+        self._waits = {}
+        self._lock = threading.Lock()
+
+    async def ado(self, key: Hashable, function: Callable[[], Awaitable]):
+        """
+        Awaits the in-flight call of a key, or starts it.
+
+        The call runs as its own task, so a cancelled caller does not cancel the
+        call for the callers sharing it; the call is cancelled once every caller
+        waiting for it has been cancelled.
+
+        Args:
+            key (Hashable): Identifies identical calls.
+            function (Callable[[], Awaitable]): Starts the call.
+
+        Returns:
+            object: The result of the call.
+        """
+        with self._lock:
+            self.calls += 1
+            task = self._tasks.get(key)
+            if task is None:
+                self.executions += 1
+                task = asyncio.ensure_future(function())
+                self._tasks[key] = task
+                self._waiters[task] = 0
+                task.add_done_callback(lambda done: self._forget(key, done))
+            else:
+                self.coalesced += 1
+                logging.info("Coalesced %s call into the one in flight", self.name)
+            self._waiters[task] += 1
+
+        abandoned = False
+        try:
+            return await asyncio.shield(task)
+        finally:
+            with self._lock:
+                self._waiters[task] -= 1
+                if not self._waiters[task]:
+                    del self._waiters[task]
+                    if not task.done():
+                        # Nobody waits for the call anymore, stop it and let the next caller start afresh
+                        abandoned = True
+                        if self._tasks.get(key) is task:
+                            del self._tasks[key]
+            if abandoned:
+                task.cancel()
+
+    def do(self, key: Hashable, function: Callable[[], object]):
+        """
+        Sync variant of ado, for calls made from worker threads.
+
+        Args:
+            key (Hashable): Identifies identical calls.
+            function (Callable[[], object]): Makes the call.
+
+        Returns:
+            object: The result of the call.
+        """
+        with self._lock:
+            self.calls += 1
+            wait = self._waits.get(key)
+            leader = wait is None
+            if leader:
+                self.executions += 1
+                wait = self._waits[key] = {"done": threading.Event()}
+            else:
+                self.coalesced += 1
+                logging.info("Coalesced %s call into the one in flight", self.name)
+
+        if not leader:
+            wait["done"].wait()
+            if "error" in wait:
+                raise wait["error"]
+            return wait["result"]
+
+        try:
+            wait["result"] = function()
+            return wait["result"]
+        except Exception as e:
+            wait["error"] = e
+            raise
+        finally:
+            with self._lock:
+                self._waits.pop(key, None)
+            wait["done"].set()
+
+    def _forget(self, key: Hashable, task: asyncio.Future) -> None:
+        with self._lock:
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+        # Marks the exception as retrieved, the waiters may all be gone
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        """
+        Returns the call counters of the group.
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._tasks) + len(self._waits),
+            }
+
+
+# Identical tool calls of an application, keyed by (tool, app_id, normalized arguments)
+tool_flights = SingleFlight("tool")
+
+# Identical /invoke queries of applications that opted in, keyed by (app_id, normalized query)
+invoke_flights = SingleFlight("invoke")
+
+# Concurrent builds of the same agent on a cache miss, keyed like the agent cache
+agent_build_flights = SingleFlight("agent_build")
+
+
+def single_flight_stats() -> dict:
+    """
+    Returns the counters of every single-flight group, keyed by group name.
+    """
+    return {group.name: group.stats() for group in (tool_flights, invoke_flights, agent_build_flights)}
+
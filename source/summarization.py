@@ -1,21 +1,54 @@
 import os
-from langchain_community.chat_message_histories import RedisChatMessageHistory
+import asyncio
+from functools import lru_cache
+from langchain_core.messages import get_buffer_string
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 import numpy as np
+import redis
 from langchain_core.prompts import PromptTemplate
 from langchain.chains.summarize import load_summarize_chain
 
 from langchain.chains.combine_documents.stuff import StuffDocumentsChain
 from langchain.chains.llm import LLMChain
 
+from chat_history import PooledRedisChatMessageHistory, get_redis_client
+from embedding_cache import CachedEmbeddings
+from metrics import MetricsCallbackHandler
+
 from dotenv import load_dotenv
 load_dotenv()
 
-llm = ChatOpenAI(temperature=0,
-                 model='gpt-3.5-turbo'
-                )
+
+@lru_cache(maxsize=None)
+def get_llm():
+    """
+    Return the summarization model, built on first use.
+    """
+    return ChatOpenAI(temperature=0,
+                      model='gpt-3.5-turbo',
+                      callbacks=[MetricsCallbackHandler()]
+                     )
+
+
+@lru_cache(maxsize=None)
+def get_embeddings():
+    """
+    Return the chunk embeddings, built on first use.
+
+    They are shared with the rest of the process through the embedding cache.
+    """
+    return CachedEmbeddings(OpenAIEmbeddings())
+
+
+def __getattr__(name:str):
+    # Keeps `summarization.llm` and `summarization.embeddings` working for existing callers
+    if name == "llm":
+        return get_llm()
+    if name == "embeddings":
+        return get_embeddings()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Get the Redis URL from the environment variable
 redis_url = os.environ.get("REDIS_URL")
@@ -24,52 +57,7 @@ os.environ['OPENAI_API_KEY'] = os.getenv('OPENAI_API_KEY')
 os.environ['SERPER_API_KEY'] = os.getenv('SERPER_API_KEY')
 
 
-def summarize(id:str)->str:
-    """
-    Summarize the  chat uing the session id.
-    """
-    message_history = RedisChatMessageHistory(
-        url=redis_url,
-        session_id=id
-        )
-        
-    message_history = str(message_history)  
-    text = ''
-    
-    for page in message_history:
-        text += page
-        
-    text_splitter = RecursiveCharacterTextSplitter(separators=["\n\n", "\n", "\t"], chunk_size=10000, chunk_overlap=50)
-
-    docs = text_splitter.create_documents([text])
-    embeddings = OpenAIEmbeddings()
-
-    vectors = embeddings.embed_documents([x.page_content for x in docs])
-    
-    num_clusters = 1
-
-    # Perform K-means clustering
-    kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init='auto').fit(vectors)
-    # Find the closest embeddings to the centroids
-
-    # Create an empty list that will hold your closest points
-    closest_indices = []
-
-    # Loop through the number of clusters you have
-    for i in range(num_clusters):
-        
-        # Get the list of distances from that particular cluster center
-        distances = np.linalg.norm(vectors - kmeans.cluster_centers_[i], axis=1)
-        
-        # Find the list position of the closest one (using argmin to find the smallest distance)
-        closest_index = np.argmin(distances)
-        
-        # Append that position to your closest indices list
-        closest_indices.append(closest_index)
-        
-    selected_indices = sorted(closest_indices)
-    
-    map_prompt = """
+map_prompt = """
         You will be given a document.
         Your goal is to extract all the human questions and give a summary of this human questions so that a reader will have a full understanding of what happened.
         Your response should be precise and according to what was said in the passage also do sentimental analysis on it and categorize the human questions in the following three
@@ -79,26 +67,288 @@ def summarize(id:str)->str:
         ```{text}```
         FULL SUMMARY:
         """
-    map_prompt_template = PromptTemplate(template=map_prompt, input_variables=["text"])
+map_prompt_template = PromptTemplate(template=map_prompt, input_variables=["text"])
+
+merge_prompt = """
+        You will be given the summary of the earlier part of a conversation and the summary of the messages that followed.
+        Merge them into a single summary of the whole conversation, keeping the format of the summaries, and recompute the sentimental analysis categories and percentages over all the human questions.
+
+        EARLIER SUMMARY:
+        ```{summary}```
+        NEW MESSAGES SUMMARY:
+        ```{new_summary}```
+        FULL SUMMARY:
+        """
+merge_prompt_template = PromptTemplate(template=merge_prompt, input_variables=["summary", "new_summary"])
+
+combine_prompt = """
+        You will be given summaries of different parts of the same conversation, separated by blank lines.
+        Combine them into a single summary of the whole conversation, keeping the format of the summaries, and recompute the sentimental analysis categories and percentages over all the human questions.
+
+        ```{text}```
+        FULL SUMMARY:
+        """
+combine_prompt_template = PromptTemplate(template=combine_prompt, input_variables=["text"])
+
+# Seconds a per-session summary checkpoint is kept after its last update
+CHECKPOINT_TTL = int(os.environ.get("SUMMARY_CHECKPOINT_TTL", 7 * 24 * 3600))
+
+# Tokens of selected chunks sent to the map step, bounds the number of clusters
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("SUMMARY_TOKEN_BUDGET", 12000))
+
+# Number of chunk summaries requested from the LLM at the same time
+MAP_CONCURRENCY = int(os.environ.get("SUMMARY_MAP_CONCURRENCY", 4))
+
+# Above this number of chunks clustering switches to MiniBatchKMeans
+MINIBATCH_THRESHOLD = 1000
+
+
+def load_documents(id:str)->list:
+    """
+    Load the chat history of a session and split it into documents.
+
+    Messages folded into the rolling summary of the session are no longer in
+    its list, so the rolling summary leads the transcript.
+    """
+    message_history = PooledRedisChatMessageHistory(session_id=id)
+
+    pipe = get_redis_client().pipeline(transaction=True)
+    pipe.lrange(message_history.key, 0, -1)
+    pipe.get(message_history.summary_key)
+    items, rolling_summary = pipe.execute()
+
+    transcript = get_buffer_string(message_history._decode(items))
+    rolling_summary = message_history._decode_summary(rolling_summary)
+    if rolling_summary:
+        transcript = f"Summary of the earlier conversation: {rolling_summary}\n\n{transcript}"
+    return split_text(transcript)
+
+
+def split_text(text:str)->list:
+    """
+    Split a conversation transcript into documents.
+    """
+    text_splitter = RecursiveCharacterTextSplitter(separators=["\n\n", "\n", "\t"], chunk_size=10000, chunk_overlap=50)
+
+    return text_splitter.create_documents([text])
+
+
+def choose_num_clusters(num_docs:int, doc_tokens:int, token_budget:int=SUMMARY_TOKEN_BUDGET)->int:
+    """
+    Choose how many representative chunks to summarize.
+
+    Grows with the square root of the number of chunks, so longer histories
+    cover more topics, and is capped by how many chunks fit the token budget.
+
+    Args:
+        num_docs (int): Number of chunks.
+        doc_tokens (int): Estimated tokens of one chunk.
+        token_budget (int): Tokens available for the selected chunks.
+
+    Returns:
+        int: Number of clusters, at least 1 and at most num_docs.
+    """
+    by_size = int(np.ceil(np.sqrt(num_docs / 2)))
+    by_budget = max(1, token_budget // max(doc_tokens, 1))
+    return max(1, min(num_docs, by_size, by_budget))
+
+
+def select_representative_indices(vectors, num_clusters:int)->list:
+    """
+    Cluster the vectors and return the index of the vector nearest to each centroid.
+
+    Args:
+        vectors: Matrix of chunk embeddings, one row per chunk.
+        num_clusters (int): Number of clusters.
+
+    Returns:
+        list: Sorted distinct indices of the representative chunks.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if num_clusters >= len(vectors):
+        return list(range(len(vectors)))
+
+    # Perform K-means clustering, mini-batches keep large histories cheap
+    if len(vectors) > MINIBATCH_THRESHOLD:
+        kmeans = MiniBatchKMeans(n_clusters=num_clusters, random_state=42, n_init='auto', batch_size=1024).fit(vectors)
+    else:
+        kmeans = KMeans(n_clusters=num_clusters, random_state=42, n_init='auto').fit(vectors)
+    centers = kmeans.cluster_centers_.astype(np.float32)
+
+    # Squared distances of every vector to every centroid in one pass: |x|^2 - 2x.c + |c|^2
+    distances = (
+        np.einsum("ij,ij->i", vectors, vectors)[:, None]
+        - 2 * vectors @ centers.T
+        + np.einsum("ij,ij->i", centers, centers)[None, :]
+    )
+    closest_indices = np.argmin(distances, axis=0)
+
+    return sorted(set(closest_indices.tolist()))
+
+
+def select_documents(docs:list, vectors:list)->list:
+    """
+    Select the documents closest to the cluster centroids of their embeddings.
+    """
+    doc_tokens = max(len(doc.page_content) for doc in docs) // 4
+    num_clusters = choose_num_clusters(len(docs), doc_tokens)
+
+    selected_indices = select_representative_indices(vectors, num_clusters)
+    
+    return [docs[doc] for doc in selected_indices]
+
+
+def summarize(id:str, incremental:bool=False)->str:
+    """
+    Summarize the  chat uing the session id.
+
+    Args:
+        id (str): The session id of the chat.
+        incremental (bool): Only summarize the messages added since the last
+            incremental summary of the session and merge them into it.
+
+    Returns:
+        str: The summary of the chat.
+    """
+    if incremental:
+        return summarize_incremental(id)
+
+    return summarize_documents(load_documents(id))
+
+
+def summarize_documents(docs:list)->str:
+    """
+    Summarize the representative documents of a conversation.
+    """
+    if not docs:
+        # Nothing was said yet, there is nothing to summarize
+        return ""
+
+    if len(docs) > 1:
+        vectors = get_embeddings().embed_documents([x.page_content for x in docs])
     
-    llm_chain = LLMChain(llm=llm, prompt=map_prompt_template)
+        selected_docs = select_documents(docs, vectors)
+    else:
+        # A single chunk is its own representative, no need to embed and cluster it
+        selected_docs = docs
+    
+    llm_chain = LLMChain(llm=get_llm(), prompt=map_prompt_template)
     
     map_chain = StuffDocumentsChain(llm_chain=llm_chain,
                              document_variable_name="text",
                              )
     
-    selected_docs = [docs[doc] for doc in selected_indices]
-    
-    # Make an empty list to hold your summaries
-    summary_list = []
-
-    # Loop through a range of the lenght of your selected docs
-    for i, doc in enumerate(selected_docs):
-        
-        # Go get a summary of the chunk
-        chunk_summary = map_chain.invoke([doc])
-        
-        # Append that summary to your list
-        summary_list.append(chunk_summary)
-        
-    return chunk_summary['output_text']
+    # Go get a summary of every selected chunk, in parallel
+    summary_list = map_chain.batch([[doc] for doc in selected_docs], config={"max_concurrency": MAP_CONCURRENCY})
+
+    if len(summary_list) == 1:
+        return summary_list[0]['output_text']
+
+    combine_chain = combine_prompt_template | get_llm()
+    combined = "\n\n".join(chunk_summary['output_text'] for chunk_summary in summary_list)
+    return combine_chain.invoke({"text": combined}).content
+
+
+def summarize_incremental(id:str)->str:
+    """
+    Summarize only the messages added to a session since its last checkpoint.
+
+    The checkpoint stores how many messages were already summarized and the
+    running summary. An unchanged session costs no LLM call, otherwise only the
+    new messages are summarized and merged into the running summary. Without a
+    usable checkpoint, the rolling summary of the folded messages is the starting point.
+
+    Args:
+        id (str): The session id of the chat.
+
+    Returns:
+        str: The summary of the whole chat.
+    """
+    message_history = PooledRedisChatMessageHistory(session_id=id)
+    checkpoint_key = f"summary_checkpoint:{id}"
+    redis_client = get_redis_client()
+
+    # The list is watched so the new messages are read at the length the checkpoint is computed from
+    with redis_client.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                pipe.watch(message_history.key)
+                length = pipe.llen(message_history.key)
+                checkpoint = pipe.hgetall(checkpoint_key)
+                rolling_summary = message_history._decode_summary(pipe.get(message_history.summary_key))
+
+                index = int(checkpoint.get(b"index", 0))
+                summary = checkpoint.get(b"summary", b"").decode("utf-8")
+                if length < index or index < 0 or not checkpoint:
+                    # No checkpoint, or the session was recreated or folded past it, start from the folded messages
+                    index, summary = 0, rolling_summary
+                if length == index:
+                    return summary
+
+                # Messages are pushed at the head of the list, so the new ones come first
+                pipe.multi()
+                pipe.lrange(message_history.key, 0, length - index - 1)
+                items = pipe.execute()[0]
+                break
+            except redis.WatchError:
+                continue
+
+    new_messages = message_history._decode(items)
+    new_summary = summarize_documents(split_text(get_buffer_string(new_messages)))
+
+    if summary:
+        merge_chain = merge_prompt_template | get_llm()
+        summary = merge_chain.invoke({"summary": summary, "new_summary": new_summary}).content
+    else:
+        summary = new_summary
+
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.hset(checkpoint_key, mapping={"index": length, "summary": summary})
+    pipe.expire(checkpoint_key, CHECKPOINT_TTL)
+    pipe.execute()
+
+    return summary
+
+
+async def astream_summary(id:str):
+    """
+    Summarize the chat using the session id, yielding LLM tokens as they are generated.
+
+    Runs the same pipeline as summarize exactly once: the history is loaded and
+    clustered, the selected chunks are summarized and the final summary is streamed.
+
+    Args:
+        id (str): The session id of the chat.
+
+    Yields:
+        str: Tokens of the summary.
+    """
+    loop = asyncio.get_running_loop()
+    docs = await loop.run_in_executor(None, load_documents, id)
+    if not docs:
+        return
+
+    if len(docs) > 1:
+        vectors = await get_embeddings().aembed_documents([x.page_content for x in docs])
+
+        # Clustering is CPU bound, keep it off the event loop
+        selected_docs = await loop.run_in_executor(None, select_documents, docs, vectors)
+    else:
+        selected_docs = docs
+
+    map_chain = map_prompt_template | get_llm()
+
+    if len(selected_docs) == 1:
+        final_chain, final_input = map_chain, {"text": selected_docs[0].page_content}
+    else:
+        # Chunk summaries are computed in parallel, only the combined summary is streamed
+        summary_list = await map_chain.abatch(
+            [{"text": doc.page_content} for doc in selected_docs],
+            config={"max_concurrency": MAP_CONCURRENCY},
+        )
+        final_chain = combine_prompt_template | get_llm()
+        final_input = {"text": "\n\n".join(chunk_summary.content for chunk_summary in summary_list)}
+
+    async for chunk in final_chain.astream(final_input):
+        if chunk.content:
+            yield chunk.content
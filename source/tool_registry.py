@@ -0,0 +1,191 @@
+import importlib
+import os
+from typing import Callable, Dict, List, Optional
+
+from langchain_core.tools import BaseTool, StructuredTool
+
+from application.settings_manager import on_settings_change, settings_hash
+from cache import LRUCache
+from logger import logging
+from metrics import observe
+from retrieval import DatabaseRetriever
+from single_flight import tool_flights
+from source.search_tools import SearchTool, WebSearchTool
+
+# Builders of each tool type, keyed by the "type" of an entry of settings["Tools"]
+tool_builders: Dict[str, Callable[[str, str, dict, dict], BaseTool]] = {}
+
+# Tools built for an application, keyed by (app_id, settings hash) or (app_id, settings hash, entry key)
+tools_cache = LRUCache(maxsize=int(os.environ.get("TOOLS_CACHE_SIZE", 64)))
+
+
+def register_tool_type(tool_type: str):
+    """
+    Registers a builder for a type of tool that applications can declare in their settings.
+
+    The builder is called with the application, the key of the entry in
+    settings["Tools"], the options of the entry and the whole settings document,
+    and returns the tool.
+
+    Args:
+        tool_type (str): Name of the type, matched against the "type" of an entry or its key.
+    """
+    def register(builder: Callable[[str, str, dict, dict], BaseTool]):
+        tool_builders[tool_type] = builder
+        return builder
+    return register
+
+
+@register_tool_type("wb_tool")
+def web_search_tool(app_id: str, key: str, options: dict, settings: dict) -> BaseTool:
+    """
+    Builds a web search tool restricted to the website_url of its options.
+
+    Options: "prompt_id" and "website_url", and optionally "name" and "description".
+    """
+    # SearchTool and WebSearchTool read their options from settings["Tools"]["wb_tool"]
+    web_search = WebSearchTool({**settings, "Tools": {**settings.get("Tools", {}), "wb_tool": options}})
+    name = options.get("name") or f"search_tool_{app_id}"
+
+    def search(question: str):
+        flight = (name, app_id, SearchTool.normalize_query(question))
+        with observe("tool_web_search", app_id):
+            return tool_flights.do(flight, lambda: web_search.wb_tool(question))
+
+    async def asearch(question: str):
+        flight = (name, app_id, SearchTool.normalize_query(question))
+        with observe("tool_web_search", app_id):
+            return await tool_flights.ado(flight, lambda: web_search.awb_tool(question))
+
+    return StructuredTool.from_function(
+        func=search,
+        coroutine=asearch,
+        name=name,
+        description=options.get(
+            "description", "This is a websearch tool that you can use for question about any website url"),
+    )
+
+
+@register_tool_type("database_tool")
+def database_tool(app_id: str, key: str, options: dict, settings: dict) -> BaseTool:
+    """
+    Builds a vector store retrieval tool.
+
+    Options: "index_name", "backend", "k", "score_threshold" and "fields" as read
+    by DatabaseRetriever, and optionally "name" and "description".
+    """
+    retriever = DatabaseRetriever(settings, tool_name=key)
+    name = options.get("name") or key
+
+    def retrieve(question: str):
+        flight = (name, app_id, SearchTool.normalize_query(question))
+        with observe("tool_database", app_id):
+            return tool_flights.do(flight, lambda: retriever.retrieve(question))
+
+    async def aretrieve(question: str):
+        flight = (name, app_id, SearchTool.normalize_query(question))
+        with observe("tool_database", app_id):
+            return await tool_flights.ado(flight, lambda: retriever.aretrieve(question))
+
+    return StructuredTool.from_function(
+        func=retrieve,
+        coroutine=aretrieve,
+        name=name,
+        description=options.get(
+            "description",
+            "Fetch general activities based on a query from Elasticsearch store and process the response."),
+    )
+
+
+# The entry configuring the azal database tool predates the "type" option
+tool_builders["azal_database_tool"] = database_tool
+
+
+def build_tools(app_id: str, settings: dict, keys: List[str]) -> List[BaseTool]:
+    """
+    Builds tools of an application from entries of its settings["Tools"].
+
+    Each entry becomes a tool of its "type", or of its key when it has no type;
+    entries with "enabled": false are skipped.
+
+    Args:
+        app_id (str): The name of the application.
+        settings (dict): Settings of the application.
+        keys (List[str]): The keys of the entries to build, in order.
+
+    Returns:
+        List[BaseTool]: The tools.
+    """
+    declared = settings.get("Tools") or {}
+    tools = []
+    for key in keys:
+        options = declared.get(key)
+        if options is None:
+            raise KeyError(f"Tool {key} of {app_id} is not configured in settings['Tools']")
+        if not options.get("enabled", True):
+            continue
+        builder = tool_builders.get(options.get("type", key))
+        if builder is None:
+            raise ValueError(f"Unknown type of tool {key} of {app_id}: {options.get('type', key)}")
+        tools.append(builder(app_id, key, options, settings))
+    return tools
+
+
+def get_tools(app_id: str, settings: dict) -> List[BaseTool]:
+    """
+    Returns the tools of an application, building them only when its settings changed.
+
+    The tools are the entries of settings["Tools"] listed in parent_settings.tools.
+    Applications that do not list their tools keep the tools_list_<tool_id> of tools_lib.
+
+    Args:
+        app_id (str): The name of the application.
+        settings (dict): Settings of the application.
+
+    Returns:
+        List[BaseTool]: The tools of the application.
+    """
+    parent_settings = settings["parent_settings"]
+    if parent_settings.get("tools") is None:
+        return getattr(importlib.import_module("tools_lib"), f"tools_list_{parent_settings['tool_id']}")
+
+    key = (app_id, settings_hash(settings))
+    tools = tools_cache.get(key)
+    if tools is None:
+        tools = build_tools(app_id, settings, parent_settings["tools"])
+        logging.info("Built %s tool(s) for app_id: %s", len(tools), app_id)
+        tools_cache.set(key, tools)
+    return tools
+
+
+def get_tool(app_id: str, key: str, settings: dict) -> BaseTool:
+    """
+    Returns one tool of an application, building it only when its settings changed.
+
+    Args:
+        app_id (str): The name of the application.
+        key (str): The key of the entry of settings["Tools"].
+        settings (dict): Settings of the application.
+
+    Returns:
+        BaseTool: The tool.
+    """
+    cache_key = (app_id, settings_hash(settings), key)
+    tool = tools_cache.get(cache_key)
+    if tool is None:
+        tool = build_tools(app_id, settings, [key])[0]
+        tools_cache.set(cache_key, tool)
+    return tool
+
+
+def invalidate_tools(app_id: Optional[str]) -> None:
+    """
+    Drops the tools built for an application.
+
+    Args:
+        app_id (str, optional): The name of the application, None for every application.
+    """
+    tools_cache.pop_where(lambda key: app_id is None or key[0] == app_id)
+
+
+on_settings_change(invalidate_tools)
@@ -5,37 +5,73 @@ sys.path.insert(1, "source")
 sys.path.insert(2, "application")
 sys.path.insert(3, "configuration")
 
-from langchain_core.tools import tool
-from source.search_tools import WebSearchTool
-from application.settings_manager import fetch_settings
-
-from database_setup import es_store
-
-@tool
-def search_tool_wildfloc(question: str):
-    """This is a websearch tool that you can use for question about any website url"""
-    settings = fetch_settings("wildfloc")
-    web_search = WebSearchTool(settings)
-    response = web_search.wb_tool(question)
-    return response
-
-@tool
-def search_tool_jordan(question: str):
-    """This is a websearch tool that you can use for question about any website url"""
-    settings = fetch_settings("jordan")
-    web_search = WebSearchTool(settings)
-    response = web_search.wb_tool(question)
-    return response
-
-@tool
-def azal_database_tool(question:str):
+from langchain_core.tools import StructuredTool
+from application.settings_manager import fetch_settings, afetch_settings
+
+import tool_registry
+
+def build_web_search_tool(app_id: str) -> StructuredTool:
+    """
+    Builds the web search tool of an application for the tools_list_<tool_id> lists.
+
+    Each call reads the settings of the application and runs the tool the
+    registry built from its "wb_tool" entry. Applications listing their tools
+    in parent_settings.tools get the registry tools directly.
+
+    Args:
+        app_id (str): The name of the application whose settings configure the search.
+
+    Returns:
+        StructuredTool: The web search tool.
+    """
+    def search(question: str):
+        return tool_registry.get_tool(app_id, "wb_tool", fetch_settings(app_id)).invoke({"question": question})
+
+    async def asearch(question: str):
+        tool = tool_registry.get_tool(app_id, "wb_tool", await afetch_settings(app_id))
+        return await tool.ainvoke({"question": question})
+
+    return StructuredTool.from_function(
+        func=search,
+        coroutine=asearch,
+        name=f"search_tool_{app_id}",
+        description="This is a websearch tool that you can use for question about any website url",
+    )
+
+search_tool_wildfloc = build_web_search_tool("wildfloc")
+search_tool_jordan = build_web_search_tool("jordan")
+
+def build_database_tool(app_id: str, name: str = None) -> StructuredTool:
     """
-    Fetch general activities based on a query from Elasticsearch store and process the response.
+    Builds the database retrieval tool of an application for the tools_list_<tool_id> lists.
+
+    Each call reads the settings of the application and runs the tool the
+    registry built from its "azal_database_tool" entry.
+
+    Args:
+        app_id (str): The name of the application whose settings configure the retrieval.
+        name (str, optional): The name of the tool, defaults to database_tool_<app_id>.
+
+    Returns:
+        StructuredTool: The database retrieval tool.
     """
-    docs = es_store.as_retriever().invoke(question)
-    return docs
+    def retrieve(question: str):
+        settings = fetch_settings(app_id)
+        return tool_registry.get_tool(app_id, "azal_database_tool", settings).invoke({"question": question})
+
+    async def aretrieve(question: str):
+        tool = tool_registry.get_tool(app_id, "azal_database_tool", await afetch_settings(app_id))
+        return await tool.ainvoke({"question": question})
+
+    return StructuredTool.from_function(
+        func=retrieve,
+        coroutine=aretrieve,
+        name=name or f"database_tool_{app_id}",
+        description="Fetch general activities based on a query from Elasticsearch store and process the response.",
+    )
+
+azal_database_tool = build_database_tool("azal", name="azal_database_tool")
 
 # Putting all tools together
 # tools_list_wildfloc = [search_tool_wildfloc]
 tools_list_jordan = [search_tool_jordan]
-
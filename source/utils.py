@@ -1,15 +1,15 @@
 # Import the necessary libraries
 import json
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
-from langchain import hub
-from langchain.callbacks.streaming_stdout import StreamingStdOutCallbackHandler
-from langchain_community.chat_message_histories import RedisChatMessageHistory
 from langchain_openai import ChatOpenAI
 
 # Import local modules
 from logger import logging
 from exception import CustomException
+from chat_history import PooledRedisChatMessageHistory
+from metrics import MetricsCallbackHandler, observe
 
 os.environ.clear()
 
@@ -17,6 +17,9 @@ os.environ.clear()
 dotenv_path = os.path.join(os.path.dirname(__file__), '../.env')
 load_dotenv(dotenv_path)
 
+# Imported after the environment is loaded, the cache reads its configuration from it
+from prompt_cache import prompt_cache
+
 
 def setup_model() -> object:
     """
@@ -36,23 +39,37 @@ def setup_model() -> object:
     model_settings = json.loads(model_settings_str)
     
     # log the settings
-    logging.info("Model settings loaded successfully", model_settings)
+    logging.info("Model settings loaded successfully: %s", model_settings)
 
     # Create and configure the ChatOpenAI model instance
     llm_model = ChatOpenAI(
         model_name=model_settings.get('model_name'),
         streaming=model_settings.get('streaming'),
-        callbacks=[StreamingStdOutCallbackHandler()],
+        callbacks=[MetricsCallbackHandler()],
         verbose=True
     )
     
     return llm_model
 
 
-# Setup the model
-model = setup_model()
+@lru_cache(maxsize=None)
+def get_model() -> object:
+    """
+    Return the process-wide large language model, built on first use.
+
+    Returns:
+        object: A Large Language Model instance.
+    """
+    return setup_model()
+
+
+def __getattr__(name: str):
+    # Keeps `utils.model` working while the model is only built when first used
+    if name == "model":
+        return get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-def get_memory(session_id) -> object:
+def get_memory(session_id, history_settings: dict = None) -> object:
     """
     Retrieve conversational memory for a given session ID.
 
@@ -61,31 +78,71 @@ def get_memory(session_id) -> object:
 
     Args:
         session_id (str): The session ID for which memory is requested.
+        history_settings (dict, optional): The "history" section of the app settings.
+            "max_messages" bounds how many recent messages are read and "token_budget"
+            bounds their size; older turns are folded into a rolling summary.
 
     Returns:
         object: Conversational Memory object.
     """
-    logging.info("Retrieving conversational memory for session ID: ", session_id)
-
-    # Create a RedisChatMessageHistory instance for storing message history
-    redis_url = os.environ.get("REDIS_URL")
-    message_history = RedisChatMessageHistory(url=redis_url, ttl=660, session_id=session_id)
+    logging.info("Retrieving conversational memory for session ID: %s", session_id)
+
+    history_settings = history_settings or {}
+    max_messages = history_settings.get("max_messages")
+    token_budget = history_settings.get("token_budget")
+    if token_budget is not None and max_messages is None:
+        max_messages = 50
+
+    # Create a message history over the shared Redis connection pool
+    message_history = PooledRedisChatMessageHistory(
+        session_id=session_id,
+        ttl=660,
+        max_messages=max_messages,
+        token_budget=token_budget,
+        summarizer=summarize_messages,
+    )
 
     logging.info("Conversational memory retrieved successfully for session ID: %s", session_id)
     
     return message_history
 
-def fetch_prompt(prompt_id) -> str:
+def summarize_messages(messages: list, previous_summary: str) -> str:
+    """
+    Fold older conversation messages into the rolling summary of a session.
+
+    Args:
+        messages (list): The messages leaving the history window, oldest first.
+        previous_summary (str): The current summary of the session, may be empty.
+
+    Returns:
+        str: The updated summary.
+    """
+    transcript = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    prompt = (
+        "Progressively summarize the conversation below, adding onto the previous summary. "
+        "Keep names, dates, places and any preferences the human stated.\n\n"
+        f"Previous summary:\n{previous_summary}\n\n"
+        f"New lines of conversation:\n{transcript}\n\n"
+        "New summary:"
+    )
+    return get_model().invoke(prompt).content
+
+def fetch_prompt(prompt_id, ttl: float = None) -> str:
     """
     Fetch a prompt from the Langchain hub.
 
+    Prompts are served from the prompt cache and only pulled from the hub
+    when no fresh copy is available in memory or on disk.
+
     Args:
         prompt_id (str): The ID of the prompt to fetch.
+        ttl (float, optional): Time to live of the cached prompt in seconds.
     Returns:
         str: The fetched prompt.
     """
-    prompt_hub= hub.pull(prompt_id)
-    logging.info(f"fetched the prompt sucessfully {prompt_hub}")   
+    with observe("prompt_fetch"):
+        prompt_hub= prompt_cache.get(prompt_id, ttl=ttl)
+    logging.info("fetched the prompt sucessfully %s", prompt_id)
     return prompt_hub
 
 # summarize("123")
@@ -0,0 +1,55 @@
+import sys
+
+# Adding paths to import custom modules
+sys.path.insert(1, "source")
+sys.path.insert(2, "application")
+sys.path.insert(3, "configuration")
+
+import pytest
+from langchain_community.utilities import GoogleSerperAPIWrapper
+
+from search_tools import SearchTool
+
+ORGANIC = [
+    {"link": "https://example.com/a", "snippet": "Opens at nine.", "attributes": {"Days": "Weekdays"}},
+    {"link": "https://example.com/b", "snippet": "Closes at five."},
+    {"link": "https://example.com/c"},
+]
+
+KNOWLEDGE_GRAPH = {
+    "title": "Museum",
+    "type": "Art museum",
+    "description": "A museum of modern art.",
+    "attributes": {"Founded": "1901"},
+}
+
+
+@pytest.mark.parametrize("results, expected", [
+    ({"answerBox": {"answer": "9 AM"}, "organic": ORGANIC}, "9 AM"),
+    ({"answerBox": {"snippet": "Opens\nat nine"}}, "Opens at nine"),
+    ({"answerBox": {"snippetHighlighted": ["nine", "AM"]}}, "nine AM"),
+    (
+        {"knowledgeGraph": KNOWLEDGE_GRAPH, "organic": ORGANIC},
+        "Museum: Art museum. A museum of modern art. Museum Founded: 1901. "
+        "Opens at nine. Days: Weekdays. Closes at five.",
+    ),
+    ({"organic": []}, "No good Google Search Result was found"),
+])
+def test_format_results(results, expected):
+    assert SearchTool._format_results(results, k=10) == expected
+
+
+def test_format_results_keeps_k_organic_results():
+    assert SearchTool._format_results({"organic": ORGANIC}, k=1) == "Opens at nine. Days: Weekdays."
+
+
+@pytest.mark.parametrize("results", [
+    {"answerBox": {"answer": "9 AM"}},
+    {"answerBox": {"snippet": "Opens\nat nine"}},
+    {"knowledgeGraph": KNOWLEDGE_GRAPH, "organic": ORGANIC},
+    {"organic": ORGANIC},
+])
+def test_format_results_matches_serper_wrapper(results):
+    # Fails when the wrapper changes the text the agent used to get from serper_api.run
+    wrapper = GoogleSerperAPIWrapper(serper_api_key="test")
+    assert SearchTool._format_results(results, wrapper.k) == wrapper._parse_results(results)